@@ -1,10 +1,14 @@
-from openai import AsyncOpenAI
 from components.command_processor import CommandProcessor
+from components.agent_inbox import AgentInbox
+from components.llm_gateway import LLMGatewayError
+from components.llm_backends import LineStream
+from components.token_estimator import estimate_tokens, estimate_message_tokens, MESSAGE_OVERHEAD_TOKENS
 
 import asyncio
+import sys
+import time
 
 class BaseAgent:
-    MAX_CONVERSATION_LENGTH = 10  # Limit to the last 10 exchanges
     COMMAND_DEFINITIONS = {
         "message_agent": {
             "description": "Send a message to another agent.",
@@ -61,33 +65,107 @@ class BaseAgent:
         "internet_fetch": {
             "description": "fetch the given URL.",
             "syntax": "internet_fetch <URL>"
+        },
+        "add_subtask": {
+            "description": "Split a task: add a sub task for a role or a specific agent. The parent task only continues once all of its sub tasks are done, and you will be given their results.",
+            "syntax": "add_subtask <parent_task_id> <role_id|agent_id> <description>"
+        },
+        "cancel_task": {
+            "description": "Cancel a task or message that has not been started yet, e.g. a sub task that is no longer needed.",
+            "syntax": "cancel_task <task_id>"
+        },
+        "set_priority": {
+            "description": "Change the priority (urgent, high, medium or low) of a task that has not been started yet.",
+            "syntax": "set_priority <task_id> <priority>"
         }
     }
     
+    # Compact layout for large organizations: no per-agent __dict__, role-level data lives in a
+    # shared RoleProfile, and the inbox, wake event and history are only created when first used.
+    __slots__ = (
+        "agent_id", "profile", "state", "conversation", "conversation_summary", "conversation_tokens",
+        "last_llm_result", "agent_manager", "task_queue", "active", "gpt_version", "roles_library",
+        "command_processor", "communication_layer", "idle_since", "_wake_event", "_inbox", "__weakref__",
+    )
+
     def __init__(self, agent_id, params, api_key, agent_manager, task_queue, gpt_version, communication_layer, roles_library, command_processor):
         """Initialize a base agent with ChatGPT compatible capabilities."""
         self.agent_id = agent_id
-        self.params = params
+        self.profile = agent_manager.role_profile(type(self), params, api_key)  # Shared by every agent of this role
         self.state = "Idle"
-        self.conversation = []  # Threaded conversation history
-        self.client = AsyncOpenAI(api_key=api_key)  # Use the OpenAI client
+        self.conversation = ()  # Recent turns, kept verbatim within the model's token budget (a list once used)
+        self.conversation_summary = ""  # Rolling summary of older turns
+        self.conversation_tokens = 0  # Estimated size of self.conversation
+        self.last_llm_result = None  # ChatResult of the latest LLM call, for usage and cost reporting
         self.agent_manager = agent_manager  # Reference to the AgentManager 
         self.task_queue = task_queue  # Reference to the task queue
         self.active = True  # Controls the agent's activity loop
         self.gpt_version = gpt_version  # GPT version to use
-        self.message_queue = asyncio.Queue()  # Queue for incoming messages
         self.roles_library = roles_library  # Store the roles library
         self.command_processor = command_processor  # Pass the command processor directly
-        # Extract boss and subordinates for easy access
-        self.boss = params.get("boss", "No direct supervisor")
-        self.subordinates = params.get("subordinates", [])
         self.communication_layer = communication_layer  # Reference to communication layer
+        self._wake_event = None  # Created when the agent first goes idle
+        self._inbox = None  # Created when the first message arrives
+        self.idle_since = None  # Loop time when the agent went to sleep waiting for work (None while busy)
+
+    @property
+    def params(self):
+        return self.profile.params
+
+    @property
+    def boss(self):
+        return self.profile.boss
+
+    @property
+    def subordinates(self):
+        return self.profile.subordinates
+
+    @property
+    def command_definitions(self):
+        return self.profile.command_definitions
+
+    @property
+    def streaming(self):
+        return self.profile.streaming
+
+    @property
+    def backend(self):
+        return self.profile.backend
+
+    @property
+    def wake_event(self):
+        """Set whenever new work may be available."""
+        if self._wake_event is None:
+            self._wake_event = asyncio.Event()
+        return self._wake_event
+
+    @property
+    def message_queue(self):
+        """Priority queue for incoming messages."""
+        if self._inbox is None:
+            self._inbox = AgentInbox(self.notify, self.task_queue, self.agent_id)
+        return self._inbox
+
+    def memory_footprint(self):
+        """Approximate bytes held by this agent alone (shared role data and services are not counted)."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.agent_id) + sys.getsizeof(self.conversation_summary)
+        size += sys.getsizeof(self.conversation) + sum(
+            sys.getsizeof(m) + sys.getsizeof(m["content"]) for m in self.conversation
+        )
+        if self._wake_event is not None:
+            size += sys.getsizeof(self._wake_event) + sys.getsizeof(self._wake_event._waiters)
+        if self._inbox is not None:
+            size += sys.getsizeof(self._inbox) + sys.getsizeof(self._inbox._queue) + sys.getsizeof(self._inbox.entries)
+        return size
 
     async def handle_command(self, command, simulation_context):
         """Handle a command given to the agent."""
         try:
             #print(f"DEBUG: Received command: {command}")  # Debug received command
             #print(f"DEBUG: Simulation context: {simulation_context}")  # Debug simulation context
+            name = command.split(maxsplit=1)[0] if command.strip() else ""
+            if name in self.COMMAND_DEFINITIONS and name not in self.command_definitions:
+                return f"Command '{name}' is not permitted for role {self.params.get('role')}."
             if command.startswith("message_agent"):
                 # Extract target and message
                 _, target_agent, *message_parts = command.split(maxsplit=2)
@@ -192,6 +270,18 @@ class BaseAgent:
                 # or we can just return the string to the agent.
                 print(f"DEBUG: {self.agent_id} got result back from command_processor: {result}")
                 return result    
+            elif command.startswith("add_subtask"):
+                # Use the command processor to handle the 'add_subtask' request
+                result = await self.command_processor.process_command(command, {
+                    "caller": self.agent_id  # the caller continues the parent task once the sub tasks are done
+                })
+                return result
+            elif command.startswith("cancel_task") or command.startswith("set_priority"):
+                # Use the command processor to look the task up by ID
+                result = await self.command_processor.process_command(command, {
+                    "caller": self.agent_id
+                })
+                return result
             else:
                 return f"Unknown command: {command}"
 
@@ -202,32 +292,19 @@ class BaseAgent:
         """Perform a task using ChatGPT."""
         self.state = "Active"
 
-        # Generate the command help text dynamically
-        commands_help = "\n".join(
-            [f"{cmd}: {info['description']} (Syntax: {info['syntax']})"
-             for cmd, info in self.COMMAND_DEFINITIONS.items()]
-        )
-        
-        # Dynamically fetch the current list of agents with roles
-        current_agent_list = ", ".join(
-            f"{agent_id} ({agent.params.get('role', 'Unknown Role')})"
-            for agent_id, agent in self.agent_manager.agents.items()
-        )
+        # Static system prompt with the current agent list (cached by the AgentManager's PromptBuilder)
+        system_prompt = self.agent_manager.prompt_builder.system_prompt(self)
 
-        # Static system prompt with dynamic agent list
-        system_prompt = (
-            f"You are agent {self.agent_id}, "
-            f"the {self.params.get('description', 'role description not provided')}.\n"
-            f"{self.params.get('prompt', 'act within your capacity')}.\n\n"
-            f"Commands you can execute to help achieve your goals are:\n{commands_help}.\n\n"
-            f"Your direct supervisor by role_id is: {self.params.get('boss', 'None')}.\n"
-            f"Your direct reports by role_id are: {', '.join(self.subordinates) or 'None'}.\n\n"
-            f"The current list of agents in this organization is: {current_agent_list}.\n"
+        # Results of sub tasks this task was waiting on, if any
+        inputs_text = "".join(
+            f"Result of sub task {task_id}:\n{result}\n" for task_id, result in task.get("inputs", {}).items()
         )
 
-        # Task-specific user prompt
-        task_prompt = (
+        # Task-specific user prompt; prepare_task_prompt() leads it with the agent's volatile context
+        task_body = (
+            f"Task ID: {task['id']}\n"
             f"Task: {task['description']}\n"
+            f"{inputs_text}"
             "Respond in the context of your role. Be precise and succinct. Only communicate if necessary "
             "to achieve your task. Use at least one command unless no action is required. "
             "Multiple commands must each start on their own line. Previous chat history is "
@@ -237,8 +314,39 @@ class BaseAgent:
             "to complete\n"
         )
 
-        # Query the AI with the clean conversation history
-        response = await self.query_chatgpt(system_prompt, task_prompt)
+        # Pick the model for this task (the role's gpt_version unless model routing is enabled)
+        router = self.agent_manager.model_router
+        tier, model = router.route(task, self.gpt_version) if router.enabled else (None, self.gpt_version)
+
+        # Query the AI with the clean conversation history; when streaming, commands run as their lines arrive
+        try:
+            while True:
+                escalation = router.escalate(tier, model, self.gpt_version) if router.enabled else None
+                # Commands cannot be taken back, so a response that may still be escalated is not streamed
+                stream = self.streaming and escalation is None
+                started = time.monotonic()
+                task_prompt = await self.prepare_task_prompt(system_prompt, task_body, model)
+                response = await self.query_chatgpt(
+                    system_prompt, task_prompt, self.process_response_line if stream else None, model
+                )
+                if router.enabled:
+                    result = self.last_llm_result
+                    cost = router.cost(model, result.prompt_tokens, result.completion_tokens) if result else 0.0
+                    self.agent_manager.performance_monitor.log_model_route(tier, model, time.monotonic() - started, cost)
+                if escalation is None or await self.response_acceptable(task_prompt, response, model):
+                    break
+                print(f"\033[33m{self.agent_id}: response from {model} failed its checks; escalating to {escalation[1]}.\033[0m")
+                self.agent_manager.performance_monitor.log_model_route(tier, model, escalated=True)
+                # The discarded prompt may have carried the roster; the one kept in history must carry it
+                self.agent_manager.prompt_builder.forget_roster(self.agent_id)
+                tier, model = escalation
+        except LLMGatewayError as e:
+            # Keep failures out of the conversation history and out of command parsing
+            print(f"\033[31mError querying ChatGPT for {self.agent_id}: {e}\033[0m")
+            self.agent_manager.prompt_builder.forget_roster(self.agent_id)  # This task prompt never reached the history
+            self.task_queue.mark_task_completed({**task, "error": e.to_dict()}, self.agent_id, f"Failed: {e}")
+            self.state = "Idle"
+            return {"task_id": task["id"], "gpt": model, "error": e.to_dict()}
 
         # Append the user prompt and AI response to conversation history
         self.append_to_conversation("user", task_prompt)
@@ -247,17 +355,88 @@ class BaseAgent:
         # Debug: Print the response for clarity
         print(f"\033[32mDEBUG: AI Response for {self.agent_id}:\033[0m\n{response}\n")
 
-        # Process the response for any commands
-        await self.process_ai_response(response)
+        # Process the response for any commands (already done line by line when streaming)
+        if not stream:
+            await self.process_ai_response(response)
 
         # Notify the task queue that the task is completed
-        self.task_queue.mark_task_completed(task, self.agent_id)
+        self.task_queue.mark_task_completed(task, self.agent_id, response)
 
         self.state = "Idle"
-        return {"task_id": task["id"], "gpt": self.gpt_version, "response": response}
+        return {"task_id": task["id"], "gpt": model, "response": response}
+
+    def response_parses(self, response):
+        """True if the response has at least one command line and every command line has its required arguments."""
+        found = False
+        for line in response.splitlines():
+            parts = line.split()
+            if not parts or parts[0] not in self.COMMAND_DEFINITIONS:
+                continue
+            found = True
+            if len(parts) - 1 < self.COMMAND_DEFINITIONS[parts[0]]["syntax"].count("<"):
+                return False
+        return found
+
+    async def response_acceptable(self, task_prompt, response, model):
+        """Checks a routed response must pass before it is used: it parses and, optionally, passes a self-check."""
+        if not self.response_parses(response):
+            return False
+        if not self.agent_manager.model_router.self_check:
+            return True
+        review = [
+            {"role": "system", "content": "You review another agent's reply. Answer with PASS or FAIL only."},
+            {"role": "user", "content": (
+                f"Task given to the agent:\n{task_prompt}\n\nAgent's reply:\n{response}\n\n"
+                "Does the reply address the task using the command format correctly?"
+            )},
+        ]
+        try:
+            result = await self.agent_manager.llm_gateway.chat(self.backend, model, review)
+        except LLMGatewayError:
+            return True  # A failed check is not a reason to spend a stronger model
+        return "FAIL" not in (result.content or "").upper()
+
+    async def prepare_task_prompt(self, system_prompt, task_body, model):
+        """Compact the history for this request, then lead the task with the agent's context (prefix_stable layout).
+
+        The context is built after compaction, so a roster that compaction just removed from the
+        history is sent again in this request rather than the next one.
+        """
+        builder = self.agent_manager.prompt_builder
+        budget = self.agent_manager.token_budget
+        limits = budget.limits(model)
+        context_tokens = builder.context_tokens(self)
+        task_body = budget.clip(task_body, max(limits["max_message_tokens"] - context_tokens, limits["max_message_tokens"] // 2))
+        await self.compact_conversation(self.history_budget(system_prompt, context_tokens + estimate_tokens(task_body), limits))
+        return f"{builder.context_prompt(self)}{task_body}"
+
+    def history_budget(self, system_prompt, task_tokens, limits):
+        """Tokens left for the verbatim history once the system prompt, task message and summary are counted."""
+        reserved = estimate_tokens(system_prompt) + task_tokens + limits["summary_tokens"] + 3 * MESSAGE_OVERHEAD_TOKENS
+        return min(limits["history_tokens"], limits["max_prompt_tokens"] - reserved)
+
+    async def query_chatgpt(self, system_prompt, task_prompt, on_line=None, model=None):
+        """Query ChatGPT asynchronously and maintain clean conversation history.
+
+        Calls go through the AgentManager's LLMGateway; failures raise LLMGatewayError.
+        With on_line the completion is streamed and on_line(line) is awaited for each complete line.
+        model overrides the agent's gpt_version (model routing). The ChatResult is kept in
+        self.last_llm_result (None when served from the response cache).
+        """
+        model = model or self.gpt_version
+        self.last_llm_result = None
+
+        # Clip oversized input and keep the whole request under the model's token ceiling
+        budget = self.agent_manager.token_budget
+        limits = budget.limits(model)
+        clipped = budget.clip(task_prompt, limits["max_message_tokens"])
+        if clipped is not task_prompt:
+            self.agent_manager.prompt_builder.forget_roster(self.agent_id)  # The roster in it may have been cut
+            task_prompt = clipped
+        # The system prompt (with the classic layout it carries the whole roster) must fit too
+        system_prompt = budget.fit_system_prompt(system_prompt, estimate_tokens(task_prompt), model)
+        await self.compact_conversation(self.history_budget(system_prompt, estimate_tokens(task_prompt), limits))
 
-    async def query_chatgpt(self, system_prompt, task_prompt):
-        """Query ChatGPT asynchronously and maintain clean conversation history."""
         # Construct the conversation with the system prompt and clean history
         conversation = [{"role": "system", "content": system_prompt}]
         conversation.extend(self.get_conversation_history())  # Append existing clean history
@@ -269,40 +448,77 @@ class BaseAgent:
             print(f"  [{idx}] {msg['role'].capitalize()}: {msg['content']}")
         print("")
 
-        try:
-            # Make the asynchronous GPT API call
-            response = await self.client.chat.completions.create(
-                model=self.gpt_version,
-                messages=conversation
-            )
-            return response.choices[0].message.content
-
-        except Exception as e:
-            print(f"Error querying ChatGPT for {self.agent_id}: {e}")
-            return f"Error querying ChatGPT: {str(e)}"
+        # Serve identical requests from the shared response cache, if enabled
+        cache = self.agent_manager.response_cache
+        cache_key = None
+        if cache:
+            cache_key = cache.make_key(model, conversation)
+            cached, tier = cache.get(cache_key)
+            self.agent_manager.performance_monitor.log_cache_lookup(tier)
+            if cached is not None:
+                if on_line:
+                    for line in cached.splitlines():
+                        await on_line(line)
+                return cached
+
+        # Make the asynchronous GPT API call (rate limited, retried and circuit-broken by the gateway)
+        lines = LineStream(on_line) if on_line else None
+        result = await self.agent_manager.llm_gateway.chat(
+            self.backend, model, conversation, lines.feed if lines else None
+        )
+        self.last_llm_result = result
+        if lines:
+            await lines.close()
+        content = result.content
+        if content is None:
+            raise LLMGatewayError("empty_response", "The model returned no content.", model=model, attempts=1)
+        if cache:
+            cache.put(cache_key, content, model)
+        return content
 
     def append_to_conversation(self, role, content):
-        """Add a new message to the conversation history."""
-        self.conversation.append({"role": role, "content": content})
-        self.truncate_conversation()
+        """Add a new message to the conversation history, clipping oversized content (e.g. fetched pages)."""
+        budget = self.agent_manager.token_budget
+        message = {"role": role, "content": budget.clip(content, budget.limits(self.gpt_version)["max_message_tokens"])}
+        if role == "user" and message["content"] is not content:
+            self.agent_manager.prompt_builder.forget_roster(self.agent_id)  # A task message's roster may have been cut
+        if not isinstance(self.conversation, list):
+            self.conversation = []
+        self.conversation.append(message)
+        self.conversation_tokens += estimate_message_tokens([message])
 
     def get_conversation_history(self):
-        """Retrieve the last N exchanges from the conversation history."""
-        return self.conversation[-self.MAX_CONVERSATION_LENGTH * 2:]  # Each exchange includes user and assistant
+        """Retrieve the rolling summary (if any) followed by the recent turns."""
+        if not self.conversation_summary:
+            return list(self.conversation)
+        summary = {"role": "system", "content": f"Summary of your earlier conversation:\n{self.conversation_summary}"}
+        return [summary, *self.conversation]
+
+    async def compact_conversation(self, max_tokens):
+        """Move the oldest exchanges into the rolling summary until the recent turns fit in max_tokens."""
+        dropped = []
+        while self.conversation and (self.conversation_tokens > max_tokens or self.conversation[0]["role"] != "user"):
+            message = self.conversation.pop(0)  # Whole exchanges go, so history never starts with a reply
+            self.conversation_tokens -= estimate_message_tokens([message])
+            dropped.append(message)
+        if dropped:
+            self.agent_manager.prompt_builder.forget_roster(self.agent_id)
+            self.conversation_summary = await self.agent_manager.token_budget.summarize(
+                self.conversation_summary, dropped, self.gpt_version, self.backend
+            )
 
-    def truncate_conversation(self):
-        """Limit the conversation history to avoid exponential growth."""
-        if len(self.conversation) > self.MAX_CONVERSATION_LENGTH * 2:
-            self.conversation = self.conversation[-self.MAX_CONVERSATION_LENGTH * 2:]
+    def message_priority(self):
+        """Priority for messages this agent sends (role "message_priority" in the meta config)."""
+        return self.roles_library.get(self.params.get("role"), {}).get("message_priority", "medium")
 
     async def send_message_agent(self, to_agent, message, simulation_context):
         """Send a message to another agent by adding it to their message queue."""
-        target_agent = simulation_context["agent_manager"].agents.get(to_agent)
+        target_agent = simulation_context["agent_manager"].get_agent(to_agent)  # Local, or in another shard
         if target_agent:
             task = {
-                "id": f"msg-{self.agent_id}-{len(target_agent.message_queue._queue) + 1}",
+                "id": self.task_queue.new_task_id("msg"),
                 "description": f"Message from {self.agent_id}: {message}",
-                "priority": "medium"
+                "priority": self.message_priority()
             }
             await target_agent.message_queue.put(task)
             #print(f"Message sent from \033[32m{self.agent_id}\033[0m to \033[32m{to_agent}\033[0m: {message}")
@@ -313,92 +529,130 @@ class BaseAgent:
     async def send_message_role(self, role_name, message, simulation_context):
         """Send a message to all agents with the specified role."""
         agent_manager = simulation_context["agent_manager"]
-        matching_agents = [
-            agent for agent_id, agent in agent_manager.agents.items()
-            if agent.params.get("role") == role_name
-        ]
+        matching_agents = agent_manager.agents_with_role(role_name)
+        # Agents of the role in other shards get the message from their own shard
+        remote_count = 0
+        if agent_manager.cluster:
+            remote_count = agent_manager.cluster.message_role(
+                role_name, f"Message from {self.agent_id}: {message}", self.message_priority()
+            )
 
-        if not matching_agents:
+        if not matching_agents and not remote_count:
             return f"No agents found with role '{role_name}'."
 
         # Send the message to each matching agent
         for target_agent in matching_agents:
             task = {
-                "id": f"msg-{self.agent_id}-{len(target_agent.message_queue._queue) + 1}",
+                "id": self.task_queue.new_task_id("msg"),
                 "description": f"Message from {self.agent_id}: {message}",
-                "priority": "medium"
+                "priority": self.message_priority()
             }
             await target_agent.message_queue.put(task)
 
-        return f"Message successfully sent to {len(matching_agents)} agents with role '{role_name}'."
+        return f"Message successfully sent to {len(matching_agents) + remote_count} agents with role '{role_name}'."
 
     async def receive_message(self, message):
         """Receive and queue a message as a task."""
         #print(f"Agent {self.agent_id} received message from {message['from']}: {message['message']}")
         task = {
-            "id": f"msg-{self.agent_id}-{len(self.message_queue._queue) + 1}",
+            "id": self.task_queue.new_task_id("msg"),
             "description": f"Message from {message['from']}: {message['message']}",
             "priority": "medium"
         }
         await self.message_queue.put(task)
         #print(f"Message queued as task for {self.agent_id}: {task}")
 
+    def notify(self):
+        """Wake the agent's activity loop (or schedule it on the worker pool) because new work may be available."""
+        pool = self.agent_manager.worker_pool
+        if pool is not None:
+            pool.schedule(self.agent_id)
+        elif self._wake_event is not None:
+            self._wake_event.set()  # An agent that never waited checks its inbox and the queue anyway
+
+    def next_task(self):
+        """Take the agent's next piece of work: queued messages first, then the task queue."""
+        if self._inbox is not None and not self._inbox.empty():
+            return self._inbox.get_nowait()
+        return self.task_queue.fetch_task_for_agent(self.agent_id, self.params.get("role"))
+
+    def has_work(self):
+        return (self._inbox is not None and not self._inbox.empty()) or self.task_queue.has_task_for(
+            self.agent_id, self.params.get("role")
+        )
+
     async def activity_loop(self):
         """Main activity loop for the agent."""
         #print(f"{self.agent_id} active state: {self.active}")
+        if self.agent_manager.worker_pool is not None:
+            self.agent_manager.worker_pool.schedule(self.agent_id)  # Pooled execution: a worker runs our tasks
+            return
+        role = self.params.get("role")
         try:
             while self.active:
-                # Prioritize message queue tasks
-                if not self.message_queue.empty():
-                    task = await self.message_queue.get()
-                else:
-                    # Fetch the next task from the task queue
-                    task = self.task_queue.fetch_task_for_agent(self.agent_id, self.params.get("role"))
+                # Clear before checking so a put that lands after the check still wakes us
+                self.wake_event.clear()
+
+                # Prioritize message queue tasks, then fetch from the task queue
+                task = self.next_task()
 
                 if task:
                     #print(f"{self.agent_id} picked up task: {task}")
                     await self.perform_task(task)
                 else:
-                    # No task available, idle briefly
-                    await asyncio.sleep(1)
+                    # No task available, sleep until the task queue or inbox wakes us
+                    self.task_queue.register_waiter(self.agent_id, role, self.notify)
+                    self.idle_since = asyncio.get_running_loop().time()
+                    try:
+                        await self.wake_event.wait()
+                    finally:
+                        self.idle_since = None
+                        # If the agent was hibernated its stand-in now holds the waiter slot; leave it
+                        self.task_queue.unregister_waiter(self.agent_id, role, self.notify)
         except Exception as e:
             print(f"Error in activity loop for {self.agent_id}: {e}")
         finally:
-            print(f"{self.agent_id} activity loop terminated. Active: {self.active}")
+            if self.state != "Hibernated":
+                print(f"{self.agent_id} activity loop terminated. Active: {self.active}")
 
     async def process_ai_response(self, response):
         """Parse and execute multiple commands from the AI's response."""
         response = response.strip()
         #print(f"DEBUG: Processing AI response: {response}")  # Debug line to log the entire response
 
-        # Split the response into individual lines
-        commands = response.splitlines()
-
         # Process each line as a separate command
-        for line in commands:
-            line = line.strip()  # Remove any leading/trailing whitespace
-            if not line:  # Skip empty lines
-                continue
-
-            # Check if the line starts with a recognized command
-            if line.startswith(tuple(self.COMMAND_DEFINITIONS.keys())):
-                command_parts = line.split(maxsplit=1)
-                command = command_parts[0]
-                arguments = command_parts[1] if len(command_parts) > 1 else ""
-                print(f"\033[32m{self.agent_id}\033[0m: \033[34m{command}\033[0m {arguments}")
-
-                # Execute the command
-                result = await self.handle_command(
-                    f"{command} {arguments}",
-                    {
-                        "agent_manager": self.agent_manager,
-                        "task_queue": self.task_queue,
-                        "roles_library": self.agent_manager.roles_library  # Ensure roles_library is passed
-                    }
-                )
-                #print(f"Command result: {result}")
-            else:
-                print(f"\033[32m{self.agent_id}\033[0m: {line}")
+        for line in response.splitlines():
+            await self.process_response_line(line)
+
+    async def process_response_line(self, line):
+        """Execute a single line of the AI's response if it is a command, otherwise just show it."""
+        line = line.strip()  # Remove any leading/trailing whitespace
+        if not line:  # Skip empty lines
+            return
+
+        # Check if the line starts with a recognized command
+        if line.startswith(tuple(self.COMMAND_DEFINITIONS.keys())):
+            command_parts = line.split(maxsplit=1)
+            command = command_parts[0]
+            arguments = command_parts[1] if len(command_parts) > 1 else ""
+            if command not in self.command_definitions:
+                # Outside this role's whitelist: skip it rather than dispatching
+                print(f"\033[32m{self.agent_id}\033[0m: \033[31m{command} (not permitted for role {self.params.get('role')})\033[0m {arguments}")
+                return
+            print(f"\033[32m{self.agent_id}\033[0m: \033[34m{command}\033[0m {arguments}")
+
+            # Execute the command
+            result = await self.handle_command(
+                f"{command} {arguments}",
+                {
+                    "agent_manager": self.agent_manager,
+                    "task_queue": self.task_queue,
+                    "roles_library": self.agent_manager.roles_library  # Ensure roles_library is passed
+                }
+            )
+            #print(f"Command result: {result}")
+        else:
+            print(f"\033[32m{self.agent_id}\033[0m: {line}")
     
     def get_info(self):
         """Return all relevant details about the agent."""
@@ -411,11 +665,12 @@ class BaseAgent:
             "Boss": self.boss or "None",
             "Subordinates": ", ".join(self.subordinates) if self.subordinates else "None",
             "GPT Version": self.gpt_version,
-            "Task Queue Size": len(self.task_queue.get_all_tasks()),
-            "Message Queue Size": self.message_queue.qsize(),
+            "Task Queue Size": self.task_queue.pending_count(),
+            "Message Queue Size": self._inbox.qsize() if self._inbox is not None else 0,
             "Conversation History": len(self.conversation),
         }
     
     def stop(self):
         """Stop the agent's activity loop."""
         self.active = False
+        self.notify()  # Let an idle loop notice it has been stopped
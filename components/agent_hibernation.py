@@ -0,0 +1,104 @@
+import json
+import os
+import sqlite3
+import zlib
+
+class HibernationStore:
+    """
+    On-disk store for the state of hibernated agents: one row per agent holding its
+    conversation, summary and params as zlib-compressed JSON. The store only lives for
+    one run, so it is emptied when opened; API keys are never written.
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS agents (agent_id TEXT PRIMARY KEY, state BLOB NOT NULL)")
+        self.conn.execute("DELETE FROM agents")
+        self.conn.commit()
+
+    def save(self, agent):
+        """Write an agent's state; call commit() once a batch of agents has been saved."""
+        state = {
+            "class": type(agent).__name__,
+            "gpt_version": agent.gpt_version,
+            "params": agent.params,
+            "conversation": list(agent.conversation),
+            "conversation_summary": agent.conversation_summary,
+            "conversation_tokens": agent.conversation_tokens,
+        }
+        blob = zlib.compress(json.dumps(state, separators=(",", ":"), default=str).encode("utf-8"))
+        self.conn.execute("INSERT OR REPLACE INTO agents (agent_id, state) VALUES (?, ?)", (agent.agent_id, blob))
+
+    def commit(self):
+        self.conn.commit()
+
+    def load(self, agent_id):
+        """Return an agent's saved state and remove it from the store (None if there is none)."""
+        row = self.conn.execute("SELECT state FROM agents WHERE agent_id = ?", (agent_id,)).fetchone()
+        if row is None:
+            return None
+        self.delete(agent_id)
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def delete(self, agent_id):
+        self.conn.execute("DELETE FROM agents WHERE agent_id = ?", (agent_id,))
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class HibernatedAgent:
+    """
+    Stands in for a hibernated agent in AgentManager.agents. It answers the cheap questions
+    (ID, role params, state) itself; anything else, such as putting a message on its
+    message_queue, revives the agent and is passed on to it.
+    """
+    __slots__ = ("agent_id", "profile", "agent_class", "gpt_version", "agent_manager", "command_processor", "active")
+    state = "Hibernated"
+    idle_since = None
+
+    def __init__(self, agent, agent_manager):
+        self.agent_id = agent.agent_id
+        self.profile = agent.profile
+        self.agent_class = type(agent)
+        self.gpt_version = agent.gpt_version
+        self.agent_manager = agent_manager
+        self.command_processor = agent.command_processor
+        self.active = agent.active
+
+    @property
+    def params(self):
+        return self.profile.params
+
+    @property
+    def boss(self):
+        return self.profile.boss
+
+    @property
+    def subordinates(self):
+        return self.profile.subordinates
+
+    def wake(self):
+        """Task queue waiter: a task for this agent (or its role) was added."""
+        self.agent_manager.revive_agent(self.agent_id)
+
+    def stop(self):
+        # No loop to stop; a revived agent stays stopped until the simulation resumes
+        self.active = False
+
+    async def activity_loop(self):
+        # Resuming a paused simulation: keep sleeping, the task queue waiter revives the agent
+        self.active = True
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.agent_manager.revive_agent(self.agent_id), name)
@@ -0,0 +1,81 @@
+import asyncio
+import heapq
+import itertools
+
+class AgentInbox(asyncio.Queue):
+    """
+    An agent's incoming message queue. Items are served by priority (with aging)
+    using the shared PriorityPolicy, and every put (awaited or put_nowait) calls
+    the owner's notify callback, so an idle agent wakes immediately instead of
+    polling the queue.
+
+    Queued items are registered in the TaskQueue's TaskIndex, so they can be looked
+    up, cancelled or re-prioritized by ID. Cancelled entries stay in the heap and
+    are skipped when they reach the top.
+    """
+    def __init__(self, notify, task_queue, owner_id):
+        self.notify = notify
+        self.task_queue = task_queue
+        self.priority_policy = task_queue.priority_policy
+        self.owner_id = owner_id
+        self._counter = itertools.count()
+        self.entries = {}  # task id -> heap entry, for live items
+        self.cancelled = set()  # seqs of cancelled heap entries
+        super().__init__()
+
+    def _init(self, maxsize):
+        self._queue = []  # Heap of (key, seq, item)
+
+    def _put(self, item):
+        self._push(item)
+        self.notify()
+
+    def _push(self, item):
+        entry = (self.priority_policy.key(item), next(self._counter), item)
+        heapq.heappush(self._queue, entry)
+        if "id" in item:
+            self.entries[item["id"]] = entry
+            self.task_queue.index.add(item["id"], self)
+
+    def _get(self):
+        while True:
+            _, seq, item = heapq.heappop(self._queue)
+            if seq in self.cancelled:
+                self.cancelled.discard(seq)
+                continue
+            if "id" in item:
+                self.entries.pop(item["id"], None)
+                self.task_queue.index.discard(item["id"], self)
+            return item
+
+    def qsize(self):
+        return len(self._queue) - len(self.cancelled)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def pending(self):
+        """Return the queued items in the order they will be served, without removing them."""
+        return [item for _, seq, item in sorted(self._queue) if seq not in self.cancelled]
+
+    # Container interface used by the TaskIndex (see components/task_registry.py)
+
+    def get_task(self, task_id):
+        return self.entries[task_id][2]
+
+    def describe(self, task_id):
+        return f"in the inbox of {self.owner_id}"
+
+    def cancel(self, task_id):
+        """Drop a queued item; it is skipped when it reaches the top of the heap."""
+        _, seq, item = self.entries.pop(task_id)
+        self.cancelled.add(seq)
+        self.task_queue.index.discard(task_id, self)
+        return item
+
+    def reprioritize(self, task_id, priority):
+        """Re-queue an item under a new priority."""
+        item = self.cancel(task_id)
+        item["priority"] = priority
+        self._push(item)
+        return item
@@ -2,6 +2,20 @@ from agents.base_agent import BaseAgent
 import asyncio
 from components.communication_layer import CommunicationLayer
 from components.command_processor import CommandProcessor
+from components.response_cache import create_response_cache
+from components.llm_client_pool import LLMClientPool
+from components.llm_gateway import LLMGateway
+from components.llm_backends import OpenAIBackend, MockBackend
+from components.llm_recorder import LLMTranscript, RecordingBackend, ReplayBackend
+from components.prompt_builder import PromptBuilder
+from components.token_budget import TokenBudget
+from components.model_router import ModelRouter
+from components.role_profile import RoleProfile
+from components.agent_hibernation import HibernationStore, HibernatedAgent
+from components.worker_pool import WorkerPool
+import itertools
+import json
+import sys
 
 class AgentManager:
     def __init__(self, config, performance_monitor, api_key, communication_layer, task_queue, roles_library, command_processor):
@@ -15,10 +29,51 @@ class AgentManager:
         self.roles_library = roles_library  # Store the roles library
         self.command_processor = command_processor  # <-- Store the command_processor
         self.agent_tasks = {}  # Store asyncio tasks for agent activity loops
+        # "per_agent": one activity loop task per agent; "worker_pool": a fixed pool of workers runs agents' tasks
+        self.execution_config = config.get("execution", {})
+        self.worker_pool = None
+        if self.execution_config.get("mode", "per_agent") == "worker_pool":
+            self.worker_pool = WorkerPool(self.execution_config, self, task_queue, performance_monitor)
+        self.roster_version = 0  # Bumped whenever an agent is spawned or terminated
+        self.role_index = {}  # role -> {agent_id: None} for local agents, in spawn order
+        self.roster_cache = (-1, [])  # (roster_version, roster()) so the roster is rebuilt only when it changes
+        self.agent_numbers = itertools.count(1)  # Suffix of new agent IDs; never reused within a run
+        self.cluster = None  # ClusterLink when this manager hosts one shard of the organisation
+        self.role_profiles = {}  # (agent class, params, api key) -> RoleProfile shared by those agents
+        self.prompt_builder = PromptBuilder(self)  # Cached system prompts, kept in step with roster_version
+        self.response_cache = create_response_cache(config.get("response_cache", {}))  # Shared LLM response cache (optional)
+        self.client_pool = LLMClientPool(config.get("llm_clients", {}))  # One pooled OpenAI client per (api_key, base_url)
+        self.llm_gateway = LLMGateway(config.get("llm_gateway", {}), performance_monitor)  # Rate limits, retries, circuit breaker
+        self.token_budget = TokenBudget(config.get("token_budget", {}), self.llm_gateway)  # Conversation windows and summaries
+        performance_monitor.register_gauge("idle_agent_memory", self.idle_agent_memory)
+        self.model_router = ModelRouter(config.get("model_routing", {}))  # Per-task model choice and escalation (optional)
+        self.backend_config = config.get("llm_backends", {})
+        self.backends = {}  # Shared LLM backends, created on first use
+        # Optional record/replay of every LLM exchange ("off", "record" or "replay")
+        self.recording_config = config.get("llm_recording", {})
+        self.recording_mode = self.recording_config.get("mode", "off")
+        self.transcript = None
+        if self.recording_mode in ("record", "replay"):
+            self.transcript = LLMTranscript(
+                self.recording_config.get("path", "data/llm_transcript.jsonl"),
+                self.recording_mode,
+                store_requests=self.recording_config.get("store_requests", False),
+                append=self.recording_config.get("append", False),
+            )
+        # Optional hibernation: agents idle for idle_seconds are parked on disk until work arrives
+        self.hibernation_config = config.get("hibernation", {})
+        self.hibernation_store = None
+        self.hibernation_sweeper = None
+        self.hibernation_stats = {"hibernated": 0, "hibernations": 0, "revivals": 0}
+        if self.hibernation_config.get("enabled", False):
+            self.hibernation_store = HibernationStore(self.hibernation_config.get("path", "data/hibernation.db"))
+            performance_monitor.register_gauge("hibernation", lambda: dict(self.hibernation_stats))
         
     async def send_command_to_agent(self, agent_id, command, simulation_context):
         """Send a command to a specific agent."""
         agent = self.agents.get(agent_id)
+        if agent is None and self.cluster and agent_id in self.cluster.remote_agents:
+            return await self.cluster.ask_owner(agent_id, "inject", command=command)
         if agent:
             response = await agent.handle_command(command, simulation_context)
             print(f"Agent {agent_id} response: {response}")
@@ -27,10 +82,15 @@ class AgentManager:
             print(f"Agent {agent_id} not found.")
             return None
             
-    async def spawn_agent(self, agent_type, params, command_processor):
-        """Spawn a new agent."""
-        role_name = params.get("name", agent_type)
-        agent_id = f"{role_name.replace(' ', '_')}_{len(self.agents) + 1}"
+    async def spawn_agent(self, agent_type, params, command_processor, agent_id=None):
+        """Spawn a new agent (on its owning shard, when the organisation is sharded)."""
+        if agent_id is None:
+            role_name = params.get("name", agent_type)
+            agent_id = f"{role_name.replace(' ', '_')}_{next(self.agent_numbers)}"
+        if self.cluster:
+            owner = self.cluster.agent_owner(params.get("role"), agent_id)
+            if owner is not None:
+                return await self.cluster.bus.request(owner, "spawn", agent_type=agent_type, params=params, agent_id=agent_id)
 
         # Debug: Spawning agent details
         #print(f"DEBUG: Spawning agent with ID {agent_id} of type {agent_type}.")
@@ -50,15 +110,183 @@ class AgentManager:
             agent = BaseAgent(agent_id, params, self.api_key, self, self.task_queue, gpt_version, self.communication_layer, self.roles_library, command_processor)
 
         self.agents[agent_id] = agent
+        self.role_index.setdefault(params.get("role"), {})[agent_id] = None
+        self.roster_version += 1
+        self.prompt_builder.agent_added(agent)
+        if self.cluster:
+            self.cluster.agent_added(agent_id, params.get("role"))
 
-        # Start the agent's activity loop
-        agent_task = asyncio.create_task(agent.activity_loop())
-        self.agent_tasks[agent_id] = agent_task
+        self.start_agent(agent)
+        if self.hibernation_store and self.hibernation_sweeper is None:
+            self.hibernation_sweeper = asyncio.create_task(self.sweep_idle_agents())
 
         # Debug: After agent is spawned
         #print(f"DEBUG: Successfully spawned agent: {agent_id}")
         return agent_id
 
+    def use_id_stride(self, offset, stride):
+        """Number new agents offset+1, offset+1+stride, ... so that shards never pick the same ID."""
+        self.agent_numbers = itertools.count(offset + 1, stride)
+
+    def get_agent(self, agent_id):
+        """Look up an agent by ID: a local agent, a RemoteAgent for one in another shard, or None."""
+        agent = self.agents.get(agent_id)
+        if agent is None and self.cluster:
+            agent = self.cluster.remote_agent(agent_id)
+        return agent
+
+    def roster(self):
+        """(agent_id, role) for every agent in the organisation, local ones first. Cached until the roster changes; do not modify."""
+        version, entries = self.roster_cache
+        if version != self.roster_version:
+            entries = [(agent_id, agent.params.get("role")) for agent_id, agent in self.agents.items()]
+            if self.cluster:
+                entries.extend((agent_id, role) for agent_id, (_, role) in self.cluster.remote_agents.items())
+            self.roster_cache = (self.roster_version, entries)
+        return entries
+
+    def agents_with_role(self, role):
+        """The local agents with this role, from the role index."""
+        return [self.agents[agent_id] for agent_id in self.role_index.get(role, ())]
+
+    def count_local_role(self, role):
+        return len(self.role_index.get(role, ()))
+
+    def count_role(self, role):
+        """Number of agents with this role across the organisation."""
+        return self.count_local_role(role) + (self.cluster.remote_count(role) if self.cluster else 0)
+
+    def remote_roster_changed(self, added=(), removed=()):
+        """Called by the ClusterLink when agents are spawned or terminated in other shards."""
+        for agent_id, role in added:
+            self.roster_version += 1
+            self.prompt_builder.entry_added(agent_id, role)
+        for agent_id in removed:
+            self.roster_version += 1
+            self.prompt_builder.agent_removed(agent_id)
+
+    def start_agent(self, agent):
+        """Start the agent's activity loop, or hand it to the worker pool."""
+        if self.worker_pool is not None:
+            self.worker_pool.schedule(agent.agent_id)
+        else:
+            self.agent_tasks[agent.agent_id] = asyncio.create_task(agent.activity_loop())
+
+    def role_profile(self, agent_class, params, api_key):
+        """Return the RoleProfile for agents spawned with these params, creating it once."""
+        key = (agent_class, json.dumps(params, sort_keys=True, default=str), api_key)
+        profile = self.role_profiles.get(key)
+        if profile is None:
+            profile = self.role_profiles[key] = RoleProfile(agent_class, params, api_key, self, self.roles_library)
+        return profile
+
+    def idle_agent_memory(self, sample_size=1000):
+        """Average bytes held per idle agent, including its activity loop task (over a sample), for the metrics."""
+        idle = [agent for agent in self.agents.values() if agent.state == "Idle" and hasattr(agent, "memory_footprint")]
+        sample = idle[:sample_size]
+        total = 0
+        for agent in sample:
+            total += agent.memory_footprint()
+            task = self.agent_tasks.get(agent.agent_id)
+            if task is not None and not task.done():
+                frame = task.get_coro().cr_frame
+                total += sys.getsizeof(task) + (sys.getsizeof(frame) if frame is not None else 0)
+        return {"idle_agents": len(idle), "sampled": len(sample), "average_bytes": int(total / len(sample)) if sample else 0}
+
+    async def sweep_idle_agents(self):
+        """Periodically hibernate agents that have been waiting for work longer than idle_seconds."""
+        idle_seconds = self.hibernation_config.get("idle_seconds", 300)
+        interval = self.hibernation_config.get("sweep_interval", 30)
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = loop.time() - idle_seconds
+            idle = [agent_id for agent_id, agent in self.agents.items()
+                    if agent.idle_since is not None and agent.idle_since <= cutoff]
+            count = sum(1 for agent_id in idle if self.hibernate_agent(agent_id, commit=False))
+            if count:
+                self.hibernation_store.commit()
+                print(f"\033[90mHibernated {count} idle agents ({self.hibernation_stats['hibernated']} parked).\033[0m")
+
+    def hibernate_agent(self, agent_id, commit=True):
+        """Park a sleeping agent: save its state, stop its loop and leave a HibernatedAgent in its place."""
+        agent = self.agents.get(agent_id)
+        if (not isinstance(agent, BaseAgent) or agent.idle_since is None
+                or (agent._wake_event is not None and agent._wake_event.is_set())
+                or (agent._inbox is not None and not agent._inbox.empty())):
+            return False  # Busy, about to wake, or already hibernated
+        self.hibernation_store.save(agent)
+        if commit:
+            self.hibernation_store.commit()
+        stub = HibernatedAgent(agent, self)
+        self.agents[agent_id] = stub
+        agent.state = "Hibernated"
+        # The stand-in takes over the agent's waiter slot, so a matching task revives it
+        self.task_queue.register_waiter(agent_id, agent.params.get("role"), stub.wake)
+        task = self.agent_tasks.pop(agent_id, None)
+        if task is not None:
+            task.cancel()
+        self.prompt_builder.release(agent_id)
+        self.hibernation_stats["hibernated"] += 1
+        self.hibernation_stats["hibernations"] += 1
+        return True
+
+    def revive_agent(self, agent_id):
+        """Bring a hibernated agent back with its saved conversation; returns the live agent."""
+        stub = self.agents.get(agent_id)
+        if not isinstance(stub, HibernatedAgent):
+            return stub
+        state = self.hibernation_store.load(agent_id) or {}
+        agent = stub.agent_class(agent_id, stub.params, stub.profile.api_key, self, self.task_queue, stub.gpt_version,
+                                 self.communication_layer, self.roles_library, stub.command_processor)
+        if state.get("conversation"):
+            agent.conversation = state["conversation"]
+        agent.conversation_summary = state.get("conversation_summary", "")
+        agent.conversation_tokens = state.get("conversation_tokens", 0)
+        agent.active = stub.active
+        self.agents[agent_id] = agent  # Same ID and role, so the roster is unchanged
+        self.task_queue.unregister_waiter(agent_id, agent.params.get("role"), stub.wake)
+        if agent.active:
+            self.start_agent(agent)
+        self.hibernation_stats["hibernated"] -= 1
+        self.hibernation_stats["revivals"] += 1
+        return agent
+
+    def get_backend(self, name=None, api_key=None, base_url=None):
+        """Return the shared LLM backend called `name` (a role's "llm_backend", else agent_manager.llm_backends.default).
+
+        "openai" uses the pooled OpenAI client; "mock" (or any entry with "type": "mock") is the local MockBackend.
+        """
+        name = name or self.backend_config.get("default", "openai")
+        settings = self.backend_config.get(name, {})
+        backend_type = settings.get("type", name)
+        key = (name, api_key, base_url)
+        if key in self.backends:
+            return self.backends[key]
+
+        if backend_type == "openai":
+            create = lambda: OpenAIBackend(self.client_pool.get_client(api_key or self.api_key, base_url or settings.get("base_url")))
+        elif backend_type == "mock":
+            create = lambda: MockBackend(settings)
+        else:
+            raise ValueError(f"Unknown LLM backend '{name}'.")
+
+        if self.recording_mode == "record":
+            backend = RecordingBackend(create(), self.transcript)
+        elif self.recording_mode == "replay":
+            on_miss = self.recording_config.get("on_miss", "error")
+            backend = ReplayBackend(
+                self.transcript,
+                fallback=create() if on_miss == "fallback" else None,  # No provider needed unless we fall back
+                on_miss=on_miss,
+                latency=self.recording_config.get("replay_latency", 0.0),
+                repeat_last=self.recording_config.get("repeat_last", True),
+            )
+        else:
+            backend = create()
+        self.backends[key] = backend
+        return backend
+
     def get_active_agents(self):
         """Return a list of active agent IDs."""
         return list(self.agents.keys())
@@ -84,11 +312,44 @@ class AgentManager:
     def terminate_agent(self, agent_id):
         """Terminate an agent."""
         if agent_id in self.agents:
-            self.agents[agent_id].stop()
+            agent = self.agents[agent_id]
+            agent.stop()
+            if isinstance(agent, HibernatedAgent):
+                self.hibernation_store.delete(agent_id)
+                self.task_queue.unregister_waiter(agent_id, agent.params.get("role"), agent.wake)
+                self.hibernation_stats["hibernated"] -= 1
+            elif self.worker_pool is not None:
+                self.worker_pool.remove(agent)
             if agent_id in self.agent_tasks:
                 self.agent_tasks[agent_id].cancel()
             del self.agents[agent_id]
+            holders = self.role_index.get(agent.params.get("role"), {})
+            holders.pop(agent_id, None)
+            if not holders:
+                self.role_index.pop(agent.params.get("role"), None)
+            self.roster_version += 1
+            self.prompt_builder.agent_removed(agent_id)
+            if self.cluster:
+                self.cluster.agent_removed(agent_id, agent.params.get("role"))
             print(f"Terminated agent: {agent_id}")
+        elif self.cluster and agent_id in self.cluster.remote_agents:
+            self.cluster.bus.post(self.cluster.remote_agents[agent_id][0], "terminate", agent_id=agent_id)
+            print(f"Terminating agent {agent_id} in {self.cluster.remote_agents[agent_id][0]}.")
         else:
             print(f"Agent {agent_id} not found.")
 
+    async def close(self):
+        """Release shared resources held on behalf of all agents."""
+        if self.cluster:
+            await self.cluster.close()
+        if self.hibernation_sweeper:
+            self.hibernation_sweeper.cancel()
+        if self.worker_pool:
+            self.worker_pool.close()
+        if self.hibernation_store:
+            self.hibernation_store.close()
+        if self.response_cache:
+            self.response_cache.close()
+        if self.transcript:
+            self.transcript.close()
+        await self.client_pool.close()
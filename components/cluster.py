@@ -0,0 +1,332 @@
+import asyncio
+import os
+import zlib
+
+from components.message_bus import TOKEN_ENV, BusClient, BusError
+
+
+class RemoteAgent:
+    """
+    Stand-in for an agent that lives in another shard, returned by AgentManager.get_agent().
+    It offers what senders use: the agent's role, a message_queue to put messages on and
+    receive_message(); both are forwarded to the agent's shard over the bus.
+    """
+    __slots__ = ("agent_id", "peer", "role", "cluster")
+    state = "Remote"
+
+    def __init__(self, agent_id, peer, role, cluster):
+        self.agent_id = agent_id
+        self.peer = peer
+        self.role = role
+        self.cluster = cluster
+
+    @property
+    def params(self):
+        return {"role": self.role}
+
+    @property
+    def message_queue(self):
+        return self
+
+    def put_nowait(self, task):
+        self.cluster.bus.post(self.peer, "deliver", agent_id=self.agent_id, task=task)
+
+    async def put(self, task):
+        self.put_nowait(task)
+
+    async def receive_message(self, message):
+        self.cluster.bus.post(self.peer, "receive_message", agent_id=self.agent_id, message=message)
+
+
+class ClusterLink:
+    """
+    Joins this process's AgentManager and TaskQueue to the rest of a sharded organisation
+    through the message bus.
+
+    Every shard hosts part of the agents and keeps a replica of the whole roster (agent ID,
+    role and owning shard), updated by the "roster" frames each shard sends when it spawns or
+    terminates an agent. With that directory:
+      - messages, role fan-out and broadcasts to remote agents are delivered by their shard
+      - a task is queued where an agent can take it: the shard of its required_agent, or a
+        shard hosting its role (local agents first); it is handed over only once it is ready,
+        so dependencies are tracked by the shard that added it, which is told when the task
+        completes ("task_done"). A task that depends on another shard's task asks for its
+        completion with "watch".
+      - spawns are placed by role (or by hash of the agent ID) onto their owning shard
+    The coordinator (the sharded controller) takes part with index None: it hosts no agents
+    and forwards everything.
+    """
+    def __init__(self, config, name, index, peer_names, agent_manager, task_queue, command_processor, roles=()):
+        self.name = name
+        self.index = index  # Position in peer_names, or None for the coordinator
+        self.peer_names = peer_names  # Names of the peers that host agents, by shard index
+        self.placement = config.get("placement", "role")
+        self.role_shards = config.get("role_shards", {})
+        # Roles not pinned in role_shards are dealt out in meta config order, so every shard agrees
+        self.role_order = {role: position for position, role in enumerate(roles)}
+        self.agent_manager = agent_manager
+        self.task_queue = task_queue
+        self.command_processor = command_processor
+        self.bus = BusClient(name, config["address"], self.handle, config.get("request_timeout", 10.0), os.getenv(TOKEN_ENV))
+        self.bus.hop_logger = agent_manager.performance_monitor.log_bus_hop
+        self.remote_agents = {}  # agent_id -> (peer, role)
+        self.remote_roles = {}  # role -> {agent_id: peer}
+        self.role_turns = {}  # role -> round-robin position among the peers hosting it
+        self.watchers = {}  # task id -> peers waiting for it to complete
+        self.parked_watches = {}  # task id -> peers watching a task this shard has not seen yet
+        self.control_handler = None  # Called with "pause", "resume", "stop", "flush" or "shutdown"
+        agent_manager.cluster = self
+        task_queue.cluster = self
+
+    async def connect(self):
+        await self.bus.connect()
+        local = [[agent_id, agent.params.get("role")] for agent_id, agent in self.agent_manager.agents.items()]
+        self.bus.post("*", "roster", added=local)
+        self.bus.post("*", "roster_request")
+
+    async def wait_for_peers(self, names, timeout=30.0):
+        """Wait until every named peer has connected (the sharded controller waits for its shards)."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not set(names) <= self.bus.peers:
+            if asyncio.get_running_loop().time() > deadline:
+                missing = ", ".join(sorted(set(names) - self.bus.peers))
+                raise BusError(f"Timed out waiting for {missing} to connect.")
+            await asyncio.sleep(0.05)
+
+    # Placement and routing
+
+    def shard_for(self, role, agent_id):
+        """Index of the shard that should host a new agent."""
+        if self.placement == "hash":
+            key = agent_id
+        elif role in self.role_shards:
+            return self.role_shards[role] % len(self.peer_names)
+        elif role in self.role_order:
+            return self.role_order[role] % len(self.peer_names)
+        else:
+            key = role or ""
+        return zlib.crc32(key.encode("utf-8")) % len(self.peer_names)
+
+    def agent_owner(self, role, agent_id):
+        """The peer that should spawn this agent, or None to spawn it here."""
+        peer = self.peer_names[self.shard_for(role, agent_id)]
+        return None if peer == self.name else peer
+
+    def task_owner(self, task):
+        """The peer a ready task should be handed to, or None to queue it here."""
+        if task.get("origin"):
+            return None  # Already handed over once; stays with the shard that received it
+        agent_id = task.get("required_agent")
+        if agent_id:
+            if agent_id in self.agent_manager.agents:
+                return None
+            if agent_id in self.remote_agents:
+                return self.remote_agents[agent_id][0]
+            return None if self.index is not None else self._fallback_peer(task.get("role"))
+        role = task.get("role")
+        if role is None or self.agent_manager.count_local_role(role):
+            return None
+        hosts = sorted(set(self.remote_roles.get(role, {}).values()))
+        if hosts:
+            turn = self.role_turns.get(role, 0)
+            self.role_turns[role] = turn + 1
+            return hosts[turn % len(hosts)]
+        if self.placement == "role" or self.index is None:
+            return self._fallback_peer(role)
+        return None
+
+    def _fallback_peer(self, role):
+        """Where a task goes when no agent can take it yet: the role's shard (round robin with hash placement)."""
+        if self.placement == "role":
+            peer = self.peer_names[self.shard_for(role, None)]
+        else:
+            turn = self.role_turns.get(None, 0)
+            self.role_turns[None] = turn + 1
+            peer = self.peer_names[turn % len(self.peer_names)]
+        return None if peer == self.name else peer
+
+    def hand_off(self, peer, task):
+        self.bus.post(peer, "add_task", task={**task, "origin": self.name})
+
+    def task_completed(self, task, agent_id, result, cancelled=False):
+        """Tell the shard that handed us this task, and any shard watching it, that it is done (or cancelled)."""
+        origin = task.get("origin")
+        peers = self.watchers.pop(task.get("id"), set())
+        if origin and origin != self.name:
+            peers.add(origin)
+        for peer in peers:
+            self.bus.post(peer, "task_done", task_id=task["id"], agent_id=agent_id, result=result, cancelled=cancelled)
+
+    def watch(self, task_id):
+        self.bus.post("*", "watch", task_id=task_id)
+
+    def task_arrived(self, task_id):
+        """Turn watches parked before this task reached us into real ones."""
+        peers = self.parked_watches.pop(task_id, None)
+        if peers:
+            self.watchers.setdefault(task_id, set()).update(peers)
+
+    # Roster
+
+    def agent_added(self, agent_id, role):
+        self.bus.post("*", "roster", added=[[agent_id, role]])
+
+    def agent_removed(self, agent_id, role):
+        self.bus.post("*", "roster", removed=[agent_id])
+
+    def remote_agent(self, agent_id):
+        entry = self.remote_agents.get(agent_id)
+        return RemoteAgent(agent_id, entry[0], entry[1], self) if entry else None
+
+    def remote_count(self, role):
+        return len(self.remote_roles.get(role, ()))
+
+    def _roster_added(self, peer, entries):
+        added = []
+        for agent_id, role in entries:
+            if agent_id in self.remote_agents:
+                continue
+            self.remote_agents[agent_id] = (peer, role)
+            self.remote_roles.setdefault(role, {})[agent_id] = peer
+            added.append((agent_id, role))
+        self.agent_manager.remote_roster_changed(added=added)
+
+    def _roster_removed(self, agent_ids):
+        removed = []
+        for agent_id in agent_ids:
+            entry = self.remote_agents.pop(agent_id, None)
+            if entry is None:
+                continue
+            holders = self.remote_roles.get(entry[1], {})
+            holders.pop(agent_id, None)
+            if not holders:
+                self.remote_roles.pop(entry[1], None)
+            removed.append(agent_id)
+        self.agent_manager.remote_roster_changed(removed=removed)
+
+    # Fan-out
+
+    def message_role(self, role, description, priority):
+        """Deliver a message to a role's agents in other shards; returns how many there are."""
+        for peer in set(self.remote_roles.get(role, {}).values()):
+            self.bus.post(peer, "deliver_role", role=role, description=description, priority=priority)
+        return self.remote_count(role)
+
+    def broadcast(self, description, exclude=None):
+        """Deliver a message to every agent in other shards; returns their IDs."""
+        self.bus.post("*", "broadcast", description=description, exclude=exclude)
+        return [agent_id for agent_id in self.remote_agents if agent_id != exclude]
+
+    async def ask_peers(self, op, **payload):
+        """Send a request to every connected peer; returns {peer: result} for the peers that answered."""
+        peers = sorted(self.bus.peers)
+        results = await asyncio.gather(*(self.bus.request(peer, op, **payload) for peer in peers), return_exceptions=True)
+        return {peer: result for peer, result in zip(peers, results) if not isinstance(result, Exception)}
+
+    async def ask_owner(self, agent_id, op, **payload):
+        """Send a request to the shard hosting a remote agent."""
+        entry = self.remote_agents.get(agent_id)
+        if entry is None:
+            raise BusError(f"Agent '{agent_id}' is not known to any shard.")
+        return await self.bus.request(entry[0], op, agent_id=agent_id, **payload)
+
+    def control(self, action):
+        self.bus.post("*", "control", action=action)
+
+    # Incoming frames
+
+    def handle(self, frame):
+        op = frame.get("op")
+        sender = frame.get("from")
+        agents = self.agent_manager.agents
+        if op == "roster":
+            if frame.get("added"):
+                self._roster_added(sender, frame["added"])
+            if frame.get("removed"):
+                self._roster_removed(frame["removed"])
+        elif op == "roster_request":
+            local = [[agent_id, agent.params.get("role")] for agent_id, agent in agents.items()]
+            self.bus.post(sender, "roster", added=local)
+        elif op == "peer_left":
+            self._roster_removed([agent_id for agent_id, (peer, _) in self.remote_agents.items() if peer == frame["peer"]])
+        elif op == "deliver":
+            agent = agents.get(frame["agent_id"])
+            if agent is None:
+                print(f"\033[33m{self.name}: message for unknown agent {frame['agent_id']} dropped.\033[0m")
+            else:
+                agent.message_queue.put_nowait(frame["task"])
+        elif op == "receive_message":
+            agent = agents.get(frame["agent_id"])
+            if agent is not None:
+                return agent.receive_message(frame["message"])
+        elif op in ("deliver_role", "broadcast"):
+            targets = self.agent_manager.agents_with_role(frame["role"]) if op == "deliver_role" else list(agents.values())
+            for agent in targets:
+                if op == "broadcast" and agent.agent_id == frame.get("exclude"):
+                    continue
+                agent.message_queue.put_nowait({
+                    "id": self.task_queue.new_task_id("msg" if op == "deliver_role" else "msg-broadcast"),
+                    "description": frame["description"],
+                    "priority": frame.get("priority", "medium"),
+                })
+        elif op == "add_task":
+            self.task_queue.add_task(frame["task"])
+        elif op == "task_done":
+            self.task_queue.remote_task_completed(
+                frame["task_id"], frame.get("agent_id"), frame.get("result"), frame.get("cancelled", False)
+            )
+            if not self.task_queue.ids.owns(frame["task_id"]):
+                self.bus.post("*", "unwatch", task_id=frame["task_id"])  # Peers that parked our watch can drop it
+        elif op == "watch":
+            task_id = frame["task_id"]
+            if task_id in self.task_queue.completed_ids:
+                cancelled = task_id in self.task_queue.cancelled_ids
+                self.bus.post(sender, "task_done", task_id=task_id, agent_id=None, result=None, cancelled=cancelled)
+            elif task_id in self.task_queue.index or task_id in self.task_queue.in_flight:
+                self.watchers.setdefault(task_id, set()).add(sender)
+            else:
+                # Not here yet (it may still be on its way to us); answer once it arrives
+                self.parked_watches.setdefault(task_id, set()).add(sender)
+        elif op == "unwatch":
+            peers = self.parked_watches.get(frame["task_id"])
+            if peers is not None:
+                peers.discard(sender)
+                if not peers:
+                    del self.parked_watches[frame["task_id"]]
+        elif op == "spawn":
+            return self.agent_manager.spawn_agent(
+                frame["agent_type"], frame["params"], self.command_processor, agent_id=frame["agent_id"]
+            )
+        elif op == "terminate":
+            self.agent_manager.terminate_agent(frame["agent_id"])
+            return True
+        elif op == "command":
+            return self.command_processor.process_command(frame["command"], {})
+        elif op == "inject":
+            return self.agent_manager.send_command_to_agent(frame["agent_id"], frame["command"], {
+                "agent_manager": self.agent_manager,
+                "task_queue": self.task_queue,
+            })
+        elif op == "agent_info":
+            agent = agents.get(frame["agent_id"])
+            return agent.get_info() if agent is not None else None
+        elif op == "lookup_task":
+            found = self.task_queue.lookup_task(frame["task_id"])
+            if found is None or found[1].startswith("handed to"):
+                return None
+            return list(found)
+        elif op == "cancel_task":
+            return self.task_queue.cancel_task(frame["task_id"])
+        elif op == "reprioritize_task":
+            return self.task_queue.reprioritize_task(frame["task_id"], frame["priority"])
+        elif op == "list_tasks":
+            return {"pending": self.task_queue.get_all_tasks(), "completed": list(self.task_queue.get_completed_tasks())}
+        elif op == "metrics":
+            return self.agent_manager.performance_monitor.get_system_metrics()
+        elif op == "control":
+            if self.control_handler is not None:
+                self.control_handler(frame["action"])
+        return None
+
+    async def close(self):
+        await self.bus.close()
@@ -3,6 +3,7 @@ class CommandProcessor:
         """Initialize the command processor."""
         #self.roles_library = roles_library
         self.global_context = global_context
+        self.agent_list_cache = (None, -1, None)  # (agent_manager, roster_version, list_agents output)
 
     async def process_command(self, command, simulation_context=None):
         """
@@ -42,7 +43,7 @@ class CommandProcessor:
                     
                     # Create a new 'task' with the result
                     new_task = {
-                        "id": f"list_roles_result-{len(target_agent.message_queue._queue)+1}",
+                        "id": self.global_context.task_queue.new_task_id("list_roles_result"),
                         "description": f"Command Output (list_roles):\n{final_output}",
                         "priority": "medium",
                     }
@@ -57,17 +58,20 @@ class CommandProcessor:
                 if not agent_manager:
                     return "\033[31mNo agent manager available.\033[0m"
 
-                active_ids = agent_manager.get_active_agents()
-                if not active_ids:
-                    final_output = "\033[31mNo active agents in the simulation.\033[0m"
-                else:
-                    # Build a formatted list of agent IDs + roles
-                    lines = []
-                    for agent_id in active_ids:
-                        agent = agent_manager.agents.get(agent_id)
-                        role = agent.params.get("role", "Unknown Role") if agent else "Unknown Role"
-                        lines.append(f"  \033[32m{agent_id}\033[0m: {role}")
-                    final_output = "\n\033[36mActive Agents:\033[0m\n" + "\n".join(lines) + "\n"
+                # Every agent in the organisation, including those hosted by other shards;
+                # the listing is reused until an agent is spawned or terminated
+                cached_manager, cached_version, final_output = self.agent_list_cache
+                if cached_manager is not agent_manager or cached_version != agent_manager.roster_version:
+                    roster = agent_manager.roster()
+                    if not roster:
+                        final_output = "\033[31mNo active agents in the simulation.\033[0m"
+                    else:
+                        # Build a formatted list of agent IDs + roles
+                        lines = []
+                        for agent_id, role in roster:
+                            lines.append(f"  \033[32m{agent_id}\033[0m: {role or 'Unknown Role'}")
+                        final_output = "\n\033[36mActive Agents:\033[0m\n" + "\n".join(lines) + "\n"
+                    self.agent_list_cache = (agent_manager, agent_manager.roster_version, final_output)
 
                 # If the caller is an agent, queue the output back to the agent
                 caller_id = simulation_context.get("caller")
@@ -76,7 +80,7 @@ class CommandProcessor:
                 if caller_id and agent_manager and caller_id in agent_manager.agents:
                     target_agent = agent_manager.agents[caller_id]
                     new_task = {
-                        "id": f"list_agents_result-{len(target_agent.message_queue._queue) + 1}",
+                        "id": self.global_context.task_queue.new_task_id("list_agents_result"),
                         "description": f"Command Output (list_agents):\n{final_output}",
                         "priority": "medium",
                     }
@@ -97,8 +101,10 @@ class CommandProcessor:
                 if not agent_manager:
                     return "No agent manager available to debug an agent."
 
-                # 3) Check if this agent exists
+                # 3) Check if this agent exists (an agent in another shard is debugged by its shard)
                 if agent_id not in agent_manager.agents:
+                    if agent_manager.cluster and agent_id in agent_manager.cluster.remote_agents:
+                        return await agent_manager.cluster.ask_owner(agent_id, "command", command=command)
                     return f"Agent '{agent_id}' not found. Available agents: {list(agent_manager.agents.keys())}"
 
                 # 4) Fetch the agent and build a debug output string
@@ -120,8 +126,8 @@ class CommandProcessor:
 
                 # 5) Conversation history
                 info_lines.append("\n\033[34mConversation History:\033[0m")
-                if agent.conversation:
-                    for idx, msg in enumerate(agent.conversation):
+                if agent.conversation or agent.conversation_summary:
+                    for idx, msg in enumerate(agent.get_conversation_history()):
                         role_label = msg.get("role", "Unknown").capitalize()
                         content = msg.get("content", "No content")
                         info_lines.append(f"  [{idx}] {role_label}: {content}")
@@ -130,21 +136,18 @@ class CommandProcessor:
 
                 # 6) Pending messages
                 info_lines.append("\n\033[35mPending Messages:\033[0m")
-                if agent.message_queue.empty():
+                if agent._inbox is None or agent._inbox.empty():
                     info_lines.append("  No pending messages.")
                 else:
-                    pending_messages = []
-                    while not agent.message_queue.empty():
-                        message = agent.message_queue.get_nowait()
-                        pending_messages.append(message)
+                    # Read the inbox in priority order without draining it
+                    pending_messages = agent.message_queue.pending()
 
                     info_lines.append("  Messages in queue:")
                     for idx, message in enumerate(pending_messages):
                         from_whom = message.get("from", "Unknown")
-                        text = message.get("message", "No message content")
-                        info_lines.append(f"  [{idx}] From: {from_whom}, Message: {text}")
-                        # Re-queue them to preserve state
-                        agent.message_queue.put_nowait(message)
+                        text = message.get("message", message.get("description", "No message content"))
+                        priority = message.get("priority", "medium")
+                        info_lines.append(f"  [{idx}] ({priority}) From: {from_whom}, Message: {text}")
 
                 # 7) Task queue reference
                 info_lines.append("\n\033[32mTasks Pending or Completed:\033[0m")
@@ -184,6 +187,7 @@ class CommandProcessor:
                 subs = role_data.get('subordinates', [])
                 lines.append(f"  \033[32mSubordinates:\033[0m {', '.join(subs) or 'None'}")
                 lines.append(f"  \033[32mGPT Version:\033[0m {role_data.get('gpt_version', 'Default')}")
+                lines.append(f"  \033[32mCommands:\033[0m {', '.join(role_data['commands']) if 'commands' in role_data else 'All'}")
                 lines.append(f"  \033[32mMinimum Count:\033[0m {role_data.get('min_count', 0)}")
                 lines.append(f"  \033[32mMaximum Count:\033[0m {role_data.get('max_count', 'Unlimited')}")
 
@@ -195,7 +199,7 @@ class CommandProcessor:
                 if caller_id and agent_manager and caller_id in agent_manager.agents:
                     target_agent = agent_manager.agents[caller_id]
                     new_task = {
-                        "id": f"role_info_result-{len(target_agent.message_queue._queue)+1}",
+                        "id": self.global_context.task_queue.new_task_id("role_info_result"),
                         "description": f"Command Output (role_info {role_name}):\n{final_output}",
                         "priority": "medium",
                     }
@@ -256,10 +260,7 @@ class CommandProcessor:
                     try:
                         max_count_int = int(max_count)  # In case it's stored as a string
                         # Count how many agents currently have this role
-                        current_count = sum(
-                            1 for aid, agent in agent_manager.agents.items()
-                            if agent.params.get("role") == role_name
-                        )
+                        current_count = agent_manager.count_role(role_name)
                         if current_count >= max_count_int:
                             # We've reached or exceeded the limit, so reject the spawn
                             return (
@@ -283,7 +284,7 @@ class CommandProcessor:
                 if caller_id and agent_manager and caller_id in agent_manager.agents:
                     target_agent = agent_manager.agents[caller_id]
                     new_task = {
-                        "id": f"spawn_result-{len(target_agent.message_queue._queue)+1}",
+                        "id": self.global_context.task_queue.new_task_id("spawn_result"),
                         "description": f"Command Output (spawn {role_name}):\n{final_output}",
                         "priority": "medium",
                     }
@@ -308,12 +309,12 @@ class CommandProcessor:
                 if not agent_manager:
                     return "Error: AgentManager is not available; cannot terminate agents."
 
-                # 2) Check if the agent exists
-                if agent_id not in agent_manager.agents:
+                # 2) Check if the agent exists (here or in another shard)
+                agent = agent_manager.get_agent(agent_id)
+                if agent is None:
                     return f"Agent '{agent_id}' not found. Available agents: {list(agent_manager.agents.keys())}"
 
-                # 3) Fetch the agent and determine its role
-                agent = agent_manager.agents[agent_id]
+                # 3) Determine the agent's role
                 role = agent.params.get("role")
                 if not role:
                     return f"Agent '{agent_id}' has no known role; cannot validate min_count."
@@ -334,10 +335,7 @@ class CommandProcessor:
                     min_count_int = 0  # default to 0 if not a valid integer
 
                 # 5) Count how many agents currently have this role
-                current_count = sum(
-                    1 for aid, a in agent_manager.agents.items()
-                    if a.params.get("role") == role
-                )
+                current_count = agent_manager.count_role(role)
 
                 # 6) If removing this agent would drop us below min_count, disallow
                 if current_count <= min_count_int:
@@ -353,7 +351,7 @@ class CommandProcessor:
                 if caller_id and caller_id in agent_manager.agents:
                     target_agent = agent_manager.agents[caller_id]
                     new_task = {
-                        "id": f"terminate_result-{len(target_agent.message_queue._queue)+1}",
+                        "id": self.global_context.task_queue.new_task_id("terminate_result"),
                         "description": f"Command Output (terminate_agent {agent_id}):\n{final_output}",
                         "priority": "medium",
                     }
@@ -390,11 +388,14 @@ class CommandProcessor:
 
                 # 3) Get the list of active agents
                 active_agents = agent_manager.get_active_agents()
-                if not active_agents:
+
+                # Agents in other shards get it from their own shard
+                remote_ids = agent_manager.cluster.broadcast(final_msg, exclude=caller_id) if agent_manager.cluster else []
+                if not active_agents and not remote_ids:
                     return "No active agents to broadcast to."
 
                 # 4) For each agent (except the caller), send a message
-                results = []
+                results = [f"Message successfully sent to {agent_id}." for agent_id in remote_ids]
                 for agent_id in active_agents:
                     if agent_id == caller_id:
                         # skip sending to self if the caller is an agent
@@ -442,7 +443,7 @@ class CommandProcessor:
                 # 5) Create a new “message” or “task” for the caller with the HTML results
                 target_agent = agent_manager.agents[caller_id]
                 new_task = {
-                    "id": f"internet_search-{len(target_agent.message_queue._queue)+1}",
+                    "id": self.global_context.task_queue.new_task_id("internet_search"),
                     "description": (f"HTML Search Results for query '{search_query}'\n"
                                     f"{html_results}"),
                     "priority": "medium",
@@ -484,7 +485,7 @@ class CommandProcessor:
                 # 4) Put the fetched data into the caller agent's queue
                 target_agent = agent_manager.agents[caller_id]
                 new_task = {
-                    "id": f"internet_fetch-{len(target_agent.message_queue._queue) + 1}",
+                    "id": self.global_context.task_queue.new_task_id("internet_fetch"),
                     "description": f"Fetched content from '{url}':\n{fetched_html}",
                     "priority": "medium",
                 }
@@ -493,23 +494,154 @@ class CommandProcessor:
                 return (f"Fetch completed for URL '{url}'. Data queued for agent '{caller_id}' "
                         f"as task ID '{new_task['id']}'.")
 
+            elif command.startswith("add_subtask"):
+                """
+                Command: add_subtask <parent_task_id> <role_id|agent_id> <description>
+                Example: add_subtask 3 Python_Developer Write the sorting function
+                Adds a sub task that the parent task depends on. A queued parent is held back until
+                all of its sub tasks complete; if the parent is already being worked on, the calling
+                agent gets a continuation task carrying the sub task results instead.
+                """
+                tokens = command.split(maxsplit=3)
+                if len(tokens) < 4:
+                    return "Usage: add_subtask <parent_task_id> <role_id|agent_id> <description>"
+
+                _, parent_id, target, description = tokens
+                parent_id = self._parse_task_id(parent_id)
+
+                # 1) Access the task queue from the global context
+                task_queue = self.global_context.task_queue
+                if not task_queue:
+                    return "Error: TaskQueue is not available; cannot add sub tasks."
+
+                # 2) Work out whether the target is a specific agent or a role
+                child_task = {"description": description.strip()}  # Takes the parent's priority
+                agent_manager = self.global_context.agent_manager
+                roles_library = self.global_context.roles_library or {}
+                if agent_manager and agent_manager.get_agent(target) is not None:
+                    child_task["required_agent"] = target
+                elif target in roles_library:
+                    child_task["role"] = target
+                else:
+                    return f"Error: '{target}' is neither an active agent nor a defined role."
+
+                # 3) Add it under the parent; the caller (if an agent) continues the parent afterwards
+                caller_id = simulation_context.get("caller") if simulation_context else None
+                try:
+                    child_task = task_queue.add_subtask(parent_id, child_task, continuation_agent=caller_id)
+                except ValueError as e:
+                    return f"Error: {e}"
+                return f"Sub task '{child_task['id']}' added under task '{parent_id}' for '{target}'."
+
+            elif command.startswith("task_info"):
+                """
+                Command: task_info <task_id>
+                Example: task_info msg-42
+                Looks up a task or message anywhere in the organisation by ID.
+                """
+                tokens = command.split(maxsplit=1)
+                if len(tokens) < 2:
+                    return "Usage: task_info <task_id>"
+
+                task_id = self._parse_task_id(tokens[1].strip())
+                task_queue = self.global_context.task_queue
+                if not task_queue:
+                    return "Error: TaskQueue is not available."
+
+                found = await self._lookup_task(task_id)
+                if found is None:
+                    return f"Task '{task_id}' not found."
+                task, location = found
+                if task is None:
+                    return f"Task '{task_id}' is {location}."
+                return (f"Task '{task_id}' is {location}.\n"
+                        f"  Priority: {task.get('priority', 'medium')}\n"
+                        f"  Description: {task.get('description', '')}")
+            elif command.startswith("cancel_task"):
+                """
+                Command: cancel_task <task_id>
+                Example: cancel_task task-7
+                Cancels a task that is queued, blocked on dependencies, or waiting in an agent's inbox.
+                """
+                tokens = command.split(maxsplit=1)
+                if len(tokens) < 2:
+                    return "Usage: cancel_task <task_id>"
+
+                task_id = self._parse_task_id(tokens[1].strip())
+                task_queue = self.global_context.task_queue
+                if not task_queue:
+                    return "Error: TaskQueue is not available; cannot cancel tasks."
+
+                if task_queue.cancel_task(task_id) is None and not await self._ask_shards("cancel_task", task_id=task_id):
+                    found = await self._lookup_task(task_id)
+                    if found is None:
+                        return f"Task '{task_id}' not found."
+                    return f"Task '{task_id}' cannot be cancelled; it is {found[1]}."
+                return f"Task '{task_id}' cancelled."
+            elif command.startswith("set_priority"):
+                """
+                Command: set_priority <task_id> <priority>
+                Example: set_priority task-7 urgent
+                Changes the priority of a queued, blocked or inbox task.
+                """
+                tokens = command.split()
+                if len(tokens) < 3:
+                    return "Usage: set_priority <task_id> <priority>"
+
+                task_id = self._parse_task_id(tokens[1])
+                priority = tokens[2]
+                task_queue = self.global_context.task_queue
+                if not task_queue:
+                    return "Error: TaskQueue is not available; cannot change priorities."
+
+                levels = task_queue.priority_policy.levels
+                if priority not in levels:
+                    return f"Unknown priority '{priority}'. Valid priorities: {', '.join(levels)}"
+
+                if task_queue.reprioritize_task(task_id, priority) is None and not await self._ask_shards(
+                    "reprioritize_task", task_id=task_id, priority=priority
+                ):
+                    return f"Task '{task_id}' is not waiting in any queue."
+                return f"Task '{task_id}' priority set to {priority}."
+
             else:
                 return f"\033[31mUnknown command: {command}\033[0m"
 
         except Exception as e:
             return f"\033[31mError processing command: {str(e)}\033[0m"
 
+    async def _lookup_task(self, task_id):
+        """Find a task here or, in a sharded organisation, in the shard that holds it."""
+        found = self.global_context.task_queue.lookup_task(task_id)
+        if found is None or found[1].startswith("handed to"):
+            remote = await self._ask_shards("lookup_task", task_id=task_id)
+            if remote:
+                return tuple(remote)
+        return found
+
+    async def _ask_shards(self, op, **payload):
+        """Ask the other shards (if any); returns the first non-empty answer, or None."""
+        agent_manager = self.global_context.agent_manager
+        if not agent_manager or not agent_manager.cluster:
+            return None
+        answers = await agent_manager.cluster.ask_peers(op, **payload)
+        return next((answer for answer in answers.values() if answer), None)
+
+    def _parse_task_id(self, task_id):
+        """Task IDs are strings; tasks restored from older runs may still use numeric IDs."""
+        return int(task_id) if task_id.isdigit() else task_id
+
     async def _send_message_to_agent(self, to_agent_id: str, message: str) -> str:
         """
         A small helper to queue a message task to the given agent, asynchronously.
         """
         agent_manager = self.global_context.agent_manager
-        if not agent_manager or to_agent_id not in agent_manager.agents:
+        target_agent = agent_manager.get_agent(to_agent_id) if agent_manager else None
+        if target_agent is None:
             return f"Message failed: Agent {to_agent_id} not found."
 
-        target_agent = agent_manager.agents[to_agent_id]
         task = {
-            "id": f"msg-broadcast-{len(target_agent.message_queue._queue) + 1}",
+            "id": self.global_context.task_queue.new_task_id("msg-broadcast"),
             "description": message,        # e.g., "[Broadcast from CFO_1]: Hello all!"
             "priority": "medium"
         }
@@ -0,0 +1,69 @@
+from collections import deque
+import gzip
+import itertools
+import json
+import os
+import time
+
+class CompletedTaskLog:
+    """
+    Bounded record of completed tasks for the in-memory TaskQueue.
+
+    The most recent `completed_history_size` entries stay in a ring buffer. Older
+    entries are streamed, `completed_spill_batch` at a time, to an append-only
+    gzip JSONL segment (one segment per run in `completed_spill_dir`, created on
+    the first spill). Each batch is written as its own gzip member, so the segment
+    is always readable while the simulation keeps appending. With the spill directory
+    set to null, old entries are dropped.
+    """
+    def __init__(self, config):
+        self.history = deque()
+        self.history_size = config.get("completed_history_size", 1000)
+        self.spill_batch_size = config.get("completed_spill_batch", 100)
+        self.spill_buffer = []
+        self.spilled = 0
+        self.dropped = 0
+
+        spill_dir = config.get("completed_spill_dir", "data/completed")
+        self.spill_path = None
+        if spill_dir:
+            self.spill_path = os.path.join(spill_dir, f"completed-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl.gz")
+
+    def append(self, entry):
+        """Record a completed task, evicting the oldest in-memory entry if the buffer is full."""
+        self.history.append(entry)
+        if len(self.history) > self.history_size:
+            evicted = self.history.popleft()
+            if self.spill_path:
+                self.spill_buffer.append(evicted)
+                if len(self.spill_buffer) >= self.spill_batch_size:
+                    self.flush()
+            else:
+                self.dropped += 1
+
+    def flush(self):
+        """Write buffered evictions to the spill segment as one gzip member."""
+        if not self.spill_buffer:
+            return
+        os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+        with gzip.open(self.spill_path, "at", encoding="utf-8") as f:
+            for entry in self.spill_buffer:
+                f.write(json.dumps(entry, default=str) + "\n")
+        self.spilled += len(self.spill_buffer)
+        self.spill_buffer = []
+
+    def iter_spilled(self):
+        """Stream entries from the spill segment, oldest first."""
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        with gzip.open(self.spill_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def __iter__(self):
+        """Iterate over every retained entry, oldest first: spilled, buffered, then in memory."""
+        # Snapshot the in-memory parts so appends during iteration don't break it
+        return itertools.chain(self.iter_spilled(), list(self.spill_buffer), list(self.history))
+
+    def __len__(self):
+        return self.spilled + len(self.spill_buffer) + len(self.history)
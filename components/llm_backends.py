@@ -0,0 +1,205 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import random
+import re
+
+from components.token_estimator import estimate_tokens, estimate_message_tokens
+
+class ChatResult:
+    """Provider-neutral result of a chat completion."""
+    def __init__(self, content, model, prompt_tokens=0, completion_tokens=0, cached_tokens=0):
+        self.content = content
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+
+class LLMBackend:
+    """
+    Interface for the chat call behind the LLMGateway.
+
+    `endpoint` identifies the provider for circuit breaking; `chat` returns a ChatResult
+    and raises the provider's own exceptions, which the gateway classifies.
+    `stream_chat` does the same but awaits on_text(delta) for each piece of text as it
+    arrives; backends without native streaming deliver the whole reply at once.
+    """
+    endpoint = "backend"
+
+    async def chat(self, model, messages):
+        raise NotImplementedError
+
+    async def stream_chat(self, model, messages, on_text):
+        result = await self.chat(model, messages)
+        if result.content:
+            await on_text(result.content)
+        return result
+
+
+class LineStream:
+    """Turns streamed text deltas into complete lines, awaiting on_line(line) as each newline arrives."""
+    def __init__(self, on_line):
+        self.on_line = on_line
+        self.buffer = ""
+
+    async def feed(self, text):
+        self.buffer += text
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            await self.on_line(line)
+
+    async def close(self):
+        """Deliver a final line that had no trailing newline."""
+        if self.buffer:
+            line, self.buffer = self.buffer, ""
+            await self.on_line(line)
+
+
+class OpenAIBackend(LLMBackend):
+    """Chat completions through a shared AsyncOpenAI client from the LLMClientPool."""
+    def __init__(self, client):
+        self.client = client
+        self.endpoint = str(client.base_url)
+
+    async def chat(self, model, messages):
+        response = await self.client.chat.completions.create(model=model, messages=messages)
+        return self._result(response.choices[0].message.content, response.model, response.usage)
+
+    async def stream_chat(self, model, messages, on_text):
+        stream = await self.client.chat.completions.create(
+            model=model, messages=messages, stream=True, stream_options={"include_usage": True}
+        )
+        parts = []
+        response_model, usage = model, None
+        async for chunk in stream:
+            response_model = chunk.model or response_model
+            if chunk.usage:
+                usage = chunk.usage  # Sent in the final chunk
+            if chunk.choices and chunk.choices[0].delta.content:
+                delta = chunk.choices[0].delta.content
+                parts.append(delta)
+                await on_text(delta)
+        return self._result("".join(parts) if parts else None, response_model, usage)
+
+    def _result(self, content, model, usage):
+        details = getattr(usage, "prompt_tokens_details", None) if usage else None
+        return ChatResult(
+            content,
+            model,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            cached_tokens=(getattr(details, "cached_tokens", 0) or 0) if details else 0,
+        )
+
+
+class MockBackend(LLMBackend):
+    """
+    Deterministic local stand-in for a provider, for offline load tests and CI.
+
+    Replies are chosen from, in order:
+      - "rules": [{"match": regex, "reply": template}], tried against the latest user message.
+        Templates may use regex backreferences (\\1, \\g<name>) and {agent_id}.
+      - "script": a list of replies handed to each agent in turn (cycled).
+      - "default_reply".
+    Replies may contain command lines such as "message_agent CTO_2 ..." or "spawn Python_Developer".
+    Simulated latency is drawn from "latency" {"min", "max"} seconds with a seeded RNG, so
+    the same request always gets the same reply and delay. When streaming, the delay is
+    spread evenly over the reply's lines.
+    With "prefix_cache" {"enabled": true} the mock reports cached_tokens like a provider with
+    automatic prompt caching: the longest run of leading messages it has seen before, if that
+    is at least "min_tokens" long.
+    """
+    endpoint = "mock"
+    AGENT_ID_PATTERN = re.compile(r"You are agent (\S+?),")
+
+    def __init__(self, config):
+        self.rules = [(re.compile(rule["match"], re.MULTILINE), rule["reply"]) for rule in config.get("rules", [])]
+        self.script = config.get("script", [])
+        self.default_reply = config.get("default_reply", "no_command")
+        latency = config.get("latency", {})
+        self.latency_min = latency.get("min", 0.0)
+        self.latency_max = latency.get("max", self.latency_min)
+        self.seed = config.get("seed", 0)
+        self.script_positions = {}  # agent_id -> next script index
+        prefix_cache = config.get("prefix_cache", {})
+        self.prefix_cache_enabled = prefix_cache.get("enabled", False)
+        self.prefix_min_tokens = prefix_cache.get("min_tokens", 1024)
+        self.prefix_max_entries = prefix_cache.get("max_entries", 10000)
+        self.prefixes = OrderedDict()  # hash of leading messages -> None, least recently used first
+
+    def _agent_id(self, messages):
+        for message in messages:
+            match = self.AGENT_ID_PATTERN.search(message.get("content") or "")
+            if match:
+                return match.group(1)
+        return "unknown"
+
+    def _reply(self, agent_id, prompt):
+        for pattern, template in self.rules:
+            match = pattern.search(prompt)
+            if match:
+                return match.expand(template).replace("{agent_id}", agent_id)
+        if self.script:
+            position = self.script_positions.get(agent_id, 0)
+            self.script_positions[agent_id] = position + 1
+            return self.script[position % len(self.script)].replace("{agent_id}", agent_id)
+        return self.default_reply.replace("{agent_id}", agent_id)
+
+    def _cached_tokens(self, model, messages):
+        """Simulated provider prefix cache, at message granularity."""
+        digest = hashlib.sha256(model.encode("utf-8"))
+        tokens = cached = 0
+        for message in messages:
+            digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+            tokens += estimate_message_tokens([message])
+            key = digest.hexdigest()
+            if key in self.prefixes:
+                self.prefixes.move_to_end(key)
+                if tokens >= self.prefix_min_tokens:
+                    cached = tokens
+            else:
+                self.prefixes[key] = None
+                if len(self.prefixes) > self.prefix_max_entries:
+                    self.prefixes.popitem(last=False)
+        return cached
+
+    def _respond(self, model, messages):
+        """Return (simulated delay, ChatResult) for a request."""
+        payload = json.dumps([model, messages], sort_keys=True)
+        rng = random.Random(f"{self.seed}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}")
+        delay = rng.uniform(self.latency_min, self.latency_max) if self.latency_max > 0 else 0.0
+
+        user_messages = [m for m in messages if m.get("role") == "user"]
+        prompt = user_messages[-1]["content"] if user_messages else ""
+        content = self._reply(self._agent_id(messages), prompt)
+
+        # Approximate token usage so rate limits and metrics behave as they would online
+        cached_tokens = self._cached_tokens(model, messages) if self.prefix_cache_enabled else 0
+        return delay, ChatResult(
+            content,
+            model,
+            prompt_tokens=estimate_message_tokens(messages),
+            completion_tokens=estimate_tokens(content),
+            cached_tokens=cached_tokens,
+        )
+
+    async def chat(self, model, messages):
+        delay, result = self._respond(model, messages)
+        if delay:
+            await asyncio.sleep(delay)
+        return result
+
+    async def stream_chat(self, model, messages, on_text):
+        delay, result = self._respond(model, messages)
+        pieces = result.content.splitlines(keepends=True) or [result.content]
+        for piece in pieces:
+            if delay:
+                await asyncio.sleep(delay / len(pieces))
+            await on_text(piece)
+        return result
@@ -0,0 +1,43 @@
+from openai import AsyncOpenAI
+
+class LLMClientPool:
+    """
+    Process-wide registry of OpenAI clients, one per (api_key, base_url).
+
+    Agents share these clients, and with them a single HTTP connection pool and
+    its TLS sessions, instead of each agent opening its own. Connection limits and
+    keep-alive come from agent_manager.llm_clients in the default config.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.default_base_url = config.get("base_url")
+        self.clients = {}  # (api_key, base_url) -> AsyncOpenAI
+
+    def get_client(self, api_key, base_url=None):
+        """Return the shared client for this key and endpoint, creating it on first use."""
+        base_url = base_url or self.default_base_url
+        key = (api_key, base_url)
+        client = self.clients.get(key)
+        if client is None:
+            # No SDK retries: the LLMGateway is the only retry layer, so its rate limits and breaker see every request
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self._make_http_client(), max_retries=0)
+            self.clients[key] = client
+        return client
+
+    def _make_http_client(self):
+        """Build the pooled HTTP client shared by every agent using one OpenAI client."""
+        import httpx
+
+        limits = httpx.Limits(
+            max_connections=self.config.get("max_connections", 100),
+            max_keepalive_connections=self.config.get("max_keepalive_connections", 20),
+            keepalive_expiry=self.config.get("keepalive_expiry", 30.0),
+        )
+        timeout = httpx.Timeout(self.config.get("timeout", 600.0), connect=self.config.get("connect_timeout", 10.0))
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    async def close(self):
+        """Close every pooled client and its connections."""
+        for client in self.clients.values():
+            await client.close()
+        self.clients.clear()
@@ -0,0 +1,391 @@
+from collections import deque
+import asyncio
+import random
+import time
+
+import openai
+
+from components.token_estimator import estimate_message_tokens
+
+class LLMGatewayError(Exception):
+    """A structured LLM call failure, returned to agents instead of an error string."""
+    def __init__(self, kind, message, model=None, retryable=False, attempts=0, status_code=None):
+        super().__init__(message)
+        self.kind = kind  # e.g. "rate_limited", "timeout", "connection", "server_error", "request_rejected"
+        self.message = message
+        self.model = model
+        self.retryable = retryable
+        self.attempts = attempts
+        self.status_code = status_code
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "message": self.message,
+            "model": self.model,
+            "retryable": self.retryable,
+            "attempts": self.attempts,
+            "status_code": self.status_code,
+        }
+
+    def __str__(self):
+        return f"{self.kind} after {self.attempts} attempt(s) on {self.model}: {self.message}"
+
+
+class TokenBucket:
+    """Allows up to `per_minute` units per minute, refilled continuously. Waiters are served in order."""
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        """Wait until `amount` units are available and take them."""
+        amount = min(amount, self.capacity)  # A single oversized request must still be able to run
+        async with self.lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def adjust(self, delta):
+        """Correct an earlier estimate once the real usage is known (may leave the bucket in debt)."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a provider that keeps failing. After `failure_threshold` consecutive
+    failures the breaker opens and callers wait for `cooldown` seconds; then a single
+    probe call is let through, and its outcome closes or re-opens the breaker.
+    """
+    def __init__(self, name, failure_threshold, cooldown):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    async def wait_until_closed(self):
+        """Pause the caller while the breaker is open. Returns True if the caller is the half-open probe."""
+        while True:
+            if self.state == "closed":
+                return False
+            if self.state == "open":
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+                    continue
+                self.state = "half_open"
+            if not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            await asyncio.sleep(min(1.0, self.cooldown))
+
+    def record_success(self):
+        if self.state != "closed":
+            print(f"\033[32mLLM circuit breaker for {self.name} closed.\033[0m")
+        self.state = "closed"
+        self.failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        """Count a provider failure; returns True if this opened the breaker."""
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            print(f"\033[31mLLM circuit breaker for {self.name} opened; pausing calls for {self.cooldown}s.\033[0m")
+            return True
+        return False
+
+
+class LLMGateway:
+    """
+    Single path for every agent's LLM call. Applies per-model token-bucket limits on
+    requests/min and tokens/min, retries transient failures with jittered exponential
+    backoff, and trips a per-endpoint circuit breaker when the provider is down.
+    Failures are raised as LLMGatewayError.
+
+    Every attempt has a per-model deadline ("timeouts", seconds) after which it is cancelled
+    and retried as a timeout. With "hedging" enabled, a non-streaming call that has not
+    answered by the model's recent p95 latency gets a second, identical request, and the
+    first reply wins. A losing primary may be left to finish in the background so the
+    latency saved can be measured.
+    """
+    def __init__(self, config, performance_monitor=None):
+        self.config = config
+        self.performance_monitor = performance_monitor
+        self.rate_limits = config.get("rate_limits", {})
+        self.expected_completion_tokens = config.get("expected_completion_tokens", 500)
+        self.max_retries = config.get("max_retries", 5)
+        self.backoff_base = config.get("backoff_base", 1.0)
+        self.backoff_max = config.get("backoff_max", 60.0)
+        self.breaker_failure_threshold = config.get("breaker_failure_threshold", 5)
+        self.breaker_cooldown = config.get("breaker_cooldown", 30.0)
+        self.timeouts = config.get("timeouts", {})
+        hedging = config.get("hedging", {})
+        self.hedging_enabled = hedging.get("enabled", False)
+        self.hedge_percentile = hedging.get("percentile", 0.95)
+        self.hedge_min_samples = hedging.get("min_samples", 20)
+        self.hedge_window = hedging.get("window", 200)
+        self.measure_losers = hedging.get("measure_losers", True)
+        self.buckets = {}  # model -> (requests bucket, tokens bucket)
+        self.breakers = {}  # endpoint -> CircuitBreaker
+        self.latencies = {}  # model -> recent latencies of unhedged (or primary) calls, in seconds
+
+    def _buckets_for(self, model):
+        if model not in self.buckets:
+            limits = self.rate_limits.get(model, self.rate_limits.get("default", {}))
+            self.buckets[model] = (
+                TokenBucket(limits.get("requests_per_minute", 500)),
+                TokenBucket(limits.get("tokens_per_minute", 200000)),
+            )
+        return self.buckets[model]
+
+    def _breaker_for(self, backend):
+        endpoint = backend.endpoint
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker(endpoint, self.breaker_failure_threshold, self.breaker_cooldown)
+        return self.breakers[endpoint]
+
+    def _estimate_tokens(self, messages):
+        """Estimated prompt size plus the expected completion."""
+        return estimate_message_tokens(messages) + self.expected_completion_tokens
+
+    def _timeout_for(self, model):
+        return self.timeouts.get(model, self.timeouts.get("default", 120.0))
+
+    def _record_latency(self, model, seconds):
+        if model not in self.latencies:
+            self.latencies[model] = deque(maxlen=self.hedge_window)
+        self.latencies[model].append(seconds)
+
+    def _hedge_delay(self, model):
+        """The model's recent latency percentile, or None while there are too few samples to hedge on."""
+        samples = self.latencies.get(model)
+        if not self.hedging_enabled or not samples or len(samples) < self.hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))]
+
+    def _log(self, event, model):
+        if self.performance_monitor:
+            self.performance_monitor.log_llm_event(event, model)
+
+    async def chat(self, backend, model, messages, on_text=None):
+        """Run a chat completion on an LLMBackend through the limits, retries and breaker. Returns a ChatResult.
+
+        With on_text the completion is streamed and on_text(delta) is awaited for each piece of text.
+        A call that fails after text has reached the caller is not retried, so nothing is delivered twice.
+        """
+        requests_bucket, tokens_bucket = self._buckets_for(model)
+        breaker = self._breaker_for(backend)
+        estimated = self._estimate_tokens(messages)
+        delivered = []  # Non-empty once streamed text has reached the caller
+
+        async def forward(text):
+            delivered.append(len(text))
+            await on_text(text)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            probe = await breaker.wait_until_closed()
+            try:
+                await requests_bucket.acquire(1)
+                await tokens_bucket.acquire(estimated)
+                if on_text:
+                    result = await self._stream(backend, model, messages, forward)
+                else:
+                    result = await self._call(backend, model, messages, requests_bucket, tokens_bucket, estimated)
+            except asyncio.CancelledError:
+                if probe:
+                    breaker.probe_in_flight = False  # The caller went away (e.g. its agent was terminated); let another probe
+                raise
+            except Exception as e:
+                error = self._classify(e, model, attempt)
+                if delivered:
+                    error.retryable = False  # Part of the reply has already been acted on
+                if error.kind in ("timeout", "connection", "server_error"):
+                    if breaker.record_failure():
+                        self._log("breaker_opened", model)
+                elif probe:
+                    breaker.probe_in_flight = False  # Let another caller probe
+                if not error.retryable or attempt > self.max_retries:
+                    self._log(f"failed_{error.kind}", model)
+                    raise error
+                delay = self._backoff_delay(attempt, e)
+                self._log("retries", model)
+                print(f"\033[33mLLM call to {model} failed ({error.kind}); retry {attempt}/{self.max_retries} in {delay:.1f}s.\033[0m")
+                await asyncio.sleep(delay)
+                continue
+
+            breaker.record_success()
+            self._log("calls", model)
+            if self.performance_monitor:
+                self.performance_monitor.log_llm_usage(model, result.prompt_tokens, result.completion_tokens, result.cached_tokens)
+            if result.total_tokens:
+                tokens_bucket.adjust(result.total_tokens - estimated)
+            return result
+
+    async def _stream(self, backend, model, messages, on_text):
+        """One streamed attempt. The model's deadline counts time spent waiting on the provider only;
+        time on_text spends acting on the text (running commands) is not held against it."""
+        timeout = self._timeout_for(model)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        paused = 0.0  # Seconds spent inside on_text
+        running = None  # Future resolved when the on_text call in progress returns
+
+        async def timed(text):
+            nonlocal paused, running
+            entered = loop.time()
+            running = loop.create_future()
+            try:
+                await on_text(text)
+            finally:
+                paused += loop.time() - entered
+                running.set_result(None)
+                running = None
+
+        stream = asyncio.ensure_future(backend.stream_chat(model, messages, timed))
+        try:
+            while not stream.done():
+                if running is not None:
+                    await asyncio.wait({stream, running}, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                remaining = timeout - (loop.time() - started - paused)
+                if remaining <= 0:
+                    stream.cancel()
+                    raise asyncio.TimeoutError(f"No response from {model} within {timeout}s.")
+                await asyncio.wait({stream}, timeout=remaining)
+        except asyncio.CancelledError:
+            stream.cancel()
+            raise
+        return stream.result()
+
+    async def _call(self, backend, model, messages, requests_bucket, tokens_bucket, estimated):
+        """One attempt with the model's deadline, hedged when the primary is slower than its recent p95."""
+        timeout = self._timeout_for(model)
+        started = time.monotonic()
+        primary = asyncio.ensure_future(backend.chat(model, messages))
+        hedge_after = self._hedge_delay(model)
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=min(hedge_after, timeout) if hedge_after is not None else timeout)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if primary in done:
+            result = primary.result()
+            self._record_latency(model, time.monotonic() - started)
+            return result
+        if hedge_after is None or hedge_after >= timeout:
+            primary.cancel()
+            raise asyncio.TimeoutError(f"No response from {model} within {timeout}s.")
+
+        # The primary is slower than usual: fire an identical request and take whichever answers first
+        self._log_hedge(model, "triggered")
+
+        async def hedge_request():
+            await requests_bucket.acquire(1)
+            await tokens_bucket.acquire(estimated)
+            return await backend.chat(model, messages)
+
+        hedge = asyncio.ensure_future(hedge_request())
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    elapsed = time.monotonic() - started
+                    if task is primary:
+                        self._record_latency(model, elapsed)
+                        self._log_hedge(model, "primary_won")
+                        hedge.cancel()
+                    else:
+                        self._log_hedge(model, "hedge_won")
+                        self._finish_loser(primary, model, started, elapsed, timeout)
+                    return task.result()
+        except asyncio.CancelledError:
+            primary.cancel()
+            hedge.cancel()
+            raise
+        primary.cancel()
+        hedge.cancel()
+        if error is not None:
+            raise error
+        raise asyncio.TimeoutError(f"No response from {model} within {timeout}s.")
+
+    def _finish_loser(self, primary, model, started, winner_elapsed, timeout):
+        """Let the slower primary finish in the background to measure the latency the hedge saved."""
+        if not self.measure_losers:
+            primary.cancel()
+            return
+        deadline = asyncio.get_running_loop().call_later(max(0.0, timeout - winner_elapsed), primary.cancel)
+
+        def measured(task):
+            deadline.cancel()
+            elapsed = timeout if task.cancelled() else time.monotonic() - started  # A cancelled primary ran into its deadline
+            if not task.cancelled():
+                task.exception()  # Retrieve it so a failed loser is not reported as unhandled
+                self._record_latency(model, elapsed)
+            if self.performance_monitor:
+                self.performance_monitor.log_hedge_saving(model, elapsed - winner_elapsed)
+
+        primary.add_done_callback(measured)
+
+    def _log_hedge(self, model, outcome):
+        if self.performance_monitor:
+            self.performance_monitor.log_hedge(model, outcome)
+
+    def _backoff_delay(self, attempt, exc):
+        """Full-jitter exponential backoff, honouring a Retry-After header when the provider sends one."""
+        response = getattr(exc, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def _classify(self, exc, model, attempts):
+        """Turn a client exception into an LLMGatewayError."""
+        if isinstance(exc, LLMGatewayError):
+            exc.attempts = attempts  # Already structured (e.g. a replay miss)
+            return exc
+        status_code = getattr(exc, "status_code", None)
+        if isinstance(exc, openai.RateLimitError):
+            kind, retryable = "rate_limited", True
+        elif isinstance(exc, (openai.APITimeoutError, asyncio.TimeoutError)):
+            kind, retryable = "timeout", True
+        elif isinstance(exc, openai.APIConnectionError):
+            kind, retryable = "connection", True
+        elif isinstance(exc, openai.APIStatusError):
+            if status_code is not None and status_code >= 500:
+                kind, retryable = "server_error", True
+            else:
+                kind, retryable = "request_rejected", False
+        else:
+            kind, retryable = "unexpected", False
+        return LLMGatewayError(kind, str(exc), model=model, retryable=retryable, attempts=attempts, status_code=status_code)
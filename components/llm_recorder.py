@@ -0,0 +1,163 @@
+from collections import deque
+import asyncio
+import json
+import os
+import re
+
+from components.llm_backends import LLMBackend, ChatResult
+from components.llm_gateway import LLMGatewayError
+from components.response_cache import ResponseCache
+
+class LLMTranscript:
+    """
+    Compact, indexed transcript of LLM exchanges, stored as JSONL (one exchange per line).
+
+    Each line holds the request key (see make_key), the model, a short preview of
+    the last user message and the response. Full requests are only stored when
+    "store_requests" is set. On open, the file is scanned once to build an index of
+    key -> byte offsets, so replay only keeps offsets in memory and reads responses on demand.
+    """
+    PREVIEW_CHARS = 200
+    # Task and message IDs from the IdAllocator ("task-12", "list_agents_result-5"); their numbers
+    # depend on how concurrent agents interleave, so they are left out of the key
+    ALLOCATED_ID = re.compile(r"\b([a-z_]+(?:-[a-z_]+)*)-\d+\b")
+
+    def __init__(self, path, mode, store_requests=False, append=False):
+        self.path = path
+        self.store_requests = store_requests
+        self.index = {}  # key -> deque of byte offsets, in recorded order
+        self.last_offsets = {}  # key -> offset of the last recorded response
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if mode == "record":
+            self.file = open(path, "a" if append else "w", encoding="utf-8")
+        else:
+            self.file = open(path, "rb")
+            self._build_index()
+
+    @classmethod
+    def make_key(cls, model, messages):
+        """Hash of the model and messages, with allocator ID numbers replaced so timing does not change the key."""
+        normalised = [
+            {**message, "content": cls.ALLOCATED_ID.sub(r"\1-#", message["content"])}
+            if isinstance(message.get("content"), str) else message
+            for message in messages
+        ]
+        return ResponseCache.make_key(model, normalised)
+
+    def _build_index(self):
+        offset = 0
+        for line in self.file:
+            key = json.loads(line)["key"]
+            self.index.setdefault(key, deque()).append(offset)
+            self.last_offsets[key] = offset
+            offset += len(line)
+
+    def record(self, key, model, messages, result):
+        """Append one exchange and flush it, so a crash keeps everything recorded so far."""
+        user_messages = [m for m in messages if m.get("role") == "user"]
+        entry = {
+            "key": key,
+            "model": model,
+            "preview": (user_messages[-1]["content"] if user_messages else "")[:self.PREVIEW_CHARS],
+            "content": result.content,
+            "prompt_tokens": result.prompt_tokens,
+            "completion_tokens": result.completion_tokens,
+            "cached_tokens": result.cached_tokens,
+        }
+        if self.store_requests:
+            entry["messages"] = messages
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+
+    def next_entry(self, key, repeat_last=True):
+        """Return the next recorded exchange for a key (in recorded order), or None."""
+        offsets = self.index.get(key)
+        if offsets:
+            offset = offsets.popleft()
+        elif repeat_last and key in self.last_offsets:
+            offset = self.last_offsets[key]
+        else:
+            return None
+        self.file.seek(offset)
+        return json.loads(self.file.readline())
+
+    def close(self):
+        self.file.close()
+
+
+class RecordingBackend(LLMBackend):
+    """Passes calls through to a real backend and records every exchange."""
+    def __init__(self, inner, transcript):
+        self.inner = inner
+        self.transcript = transcript
+        self.endpoint = inner.endpoint
+
+    async def chat(self, model, messages):
+        result = await self.inner.chat(model, messages)
+        self.transcript.record(LLMTranscript.make_key(model, messages), model, messages, result)
+        return result
+
+    async def stream_chat(self, model, messages, on_text):
+        result = await self.inner.stream_chat(model, messages, on_text)
+        self.transcript.record(LLMTranscript.make_key(model, messages), model, messages, result)
+        return result
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Serves recorded responses without calling the provider. A request that is not in the
+    transcript either fails loudly (on_miss "error") or goes to the fallback backend
+    (on_miss "fallback").
+    """
+    endpoint = "replay"
+
+    def __init__(self, transcript, fallback=None, on_miss="error", latency=0.0, repeat_last=True):
+        self.transcript = transcript
+        self.fallback = fallback
+        self.on_miss = on_miss
+        self.latency = latency
+        self.repeat_last = repeat_last
+
+    async def chat(self, model, messages):
+        entry = self.transcript.next_entry(LLMTranscript.make_key(model, messages), self.repeat_last)
+        if entry is None:
+            if self.on_miss == "fallback" and self.fallback is not None:
+                return await self.fallback.chat(model, messages)
+            self._miss(model, messages)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._result(entry)
+
+    async def stream_chat(self, model, messages, on_text):
+        entry = self.transcript.next_entry(LLMTranscript.make_key(model, messages), self.repeat_last)
+        if entry is None:
+            if self.on_miss == "fallback" and self.fallback is not None:
+                return await self.fallback.stream_chat(model, messages, on_text)
+            self._miss(model, messages)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result = self._result(entry)
+        if result.content:
+            await on_text(result.content)
+        return result
+
+    def _miss(self, model, messages):
+        user_messages = [m for m in messages if m.get("role") == "user"]
+        preview = (user_messages[-1]["content"] if user_messages else "")[:LLMTranscript.PREVIEW_CHARS]
+        raise LLMGatewayError(
+            "replay_miss",
+            f"No recorded response in {self.transcript.path} for this request. Last user message: {preview!r}",
+            model=model,
+        )
+
+    def _result(self, entry):
+        return ChatResult(
+            entry["content"],
+            entry["model"],
+            prompt_tokens=entry.get("prompt_tokens", 0),
+            completion_tokens=entry.get("completion_tokens", 0),
+            cached_tokens=entry.get("cached_tokens", 0),
+        )
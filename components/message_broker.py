@@ -0,0 +1,49 @@
+import argparse
+import asyncio
+import ipaddress
+import os
+
+from components.message_bus import TOKEN_ENV, MessageHub, parse_address
+
+
+def is_loopback(address):
+    """Whether the broker would only be reachable from this host."""
+    kind, target = parse_address(address)
+    if kind == "unix":
+        return True
+    host = target[0]
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+async def run_broker(address, token=None):
+    """Route frames between the nodes of a multi-node organisation until interrupted."""
+    hub = await MessageHub(address, name="broker", token=token).start()
+    print(f"Message broker listening on {address}{' (token required)' if token else ''}.")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await hub.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the message broker that connects simulation nodes.")
+    parser.add_argument(
+        "--listen",
+        type=str,
+        default="tcp:127.0.0.1:7650",
+        help='Address to listen on: "tcp:<host>:<port>" or "unix:<path>".'
+    )
+    args = parser.parse_args()
+    token = os.getenv(TOKEN_ENV)
+    # Peers can spawn and terminate agents, run commands and shut nodes down, so never serve them unauthenticated
+    if not token and not is_loopback(args.listen):
+        parser.error(f"listening on {args.listen} requires a shared token in {TOKEN_ENV} (set the same one on every node).")
+    try:
+        asyncio.run(run_broker(args.listen, token))
+    except KeyboardInterrupt:
+        print("Message broker stopped.")
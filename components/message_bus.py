@@ -0,0 +1,302 @@
+import asyncio
+import hmac
+import inspect
+import itertools
+import json
+import os
+import struct
+import time
+
+# Every frame is a 4-byte big-endian length followed by that many bytes of UTF-8 JSON
+HEADER = struct.Struct(">I")
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+# Shared secret peers present in their hello; hubs started with a token turn away peers without it
+TOKEN_ENV = "MESSAGE_BUS_TOKEN"
+
+
+class BusError(Exception):
+    """A bus request failed: unknown peer, remote error, timeout or lost connection."""
+
+
+def encode_frame(message):
+    data = json.dumps(message, separators=(",", ":"), default=str).encode("utf-8")
+    return HEADER.pack(len(data)) + data
+
+
+async def read_frame(reader):
+    """Read one frame; raises asyncio.IncompleteReadError when the peer has gone."""
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_FRAME_BYTES:
+        raise BusError(f"Frame of {length} bytes exceeds the {MAX_FRAME_BYTES} byte limit.")
+    return json.loads(await reader.readexactly(length))
+
+
+def parse_address(address):
+    """"unix:<path>" or "tcp:<host>:<port>" (a bare "<host>:<port>" is TCP)."""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    if address.startswith("tcp:"):
+        address = address[len("tcp:"):]
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+async def open_connection(address):
+    kind, target = parse_address(address)
+    if kind == "unix":
+        return await asyncio.open_unix_connection(target)
+    return await asyncio.open_connection(*target)
+
+
+async def start_server(address, client_connected):
+    kind, target = parse_address(address)
+    if kind == "unix":
+        directory = os.path.dirname(target)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(target):
+            os.remove(target)  # Stale socket from an earlier run
+        return await asyncio.start_unix_server(client_connected, target)
+    return await asyncio.start_server(client_connected, *target)
+
+
+class MessageHub:
+    """
+    Routes frames between named peers connected over a Unix socket or TCP.
+
+    A peer opens with {"op": "hello", "from": <name>}, plus "token" when the hub was given
+    one; a peer without the right token is rejected before it can send anything else.
+    Every later frame names its destination in "to": a peer name, or "*" for every other
+    peer. The hub stamps "from" and forwards the frame unchanged; it keeps no state beyond
+    the peer table. Peers are
+    told when others join or leave ("peer_joined" / "peer_left"), and a new peer gets a
+    "welcome" frame listing everyone already connected. Frames are stamped with the wall
+    clock time they were routed ("routed"), for the receiver's per-hop latency.
+    """
+    def __init__(self, address, name="hub", token=None):
+        self.address = address
+        self.name = name
+        self.token = token
+        self.peers = {}  # peer name -> StreamWriter
+        self.connections = set()  # Connection handler tasks, awaited on close
+        self.server = None
+
+    async def start(self):
+        self.server = await start_server(self.address, self._serve)
+        return self
+
+    async def _serve(self, reader, writer):
+        name = None
+        self.connections.add(asyncio.current_task())
+        try:
+            hello = await read_frame(reader)
+            name = hello.get("from")
+            if hello.get("op") != "hello" or not name or name in self.peers:
+                writer.write(encode_frame({"op": "rejected", "from": self.name, "reason": f"bad or duplicate peer name {name!r}"}))
+                name = None
+                return
+            if self.token and not hmac.compare_digest(str(hello.get("token", "")).encode(), self.token.encode()):
+                writer.write(encode_frame({"op": "rejected", "from": self.name, "reason": "bad or missing bus token"}))
+                print(f"\033[33mMessage hub: rejected peer {name!r} without a valid token.\033[0m")
+                name = None
+                return
+            writer.write(encode_frame({"op": "welcome", "from": self.name, "peers": list(self.peers)}))
+            await self._route(self.name, {"op": "peer_joined", "to": "*", "peer": name})
+            self.peers[name] = writer
+            while True:
+                await self._route(name, await read_frame(reader))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"\033[31mMessage hub: dropping peer {name}: {e}\033[0m")
+        finally:
+            if name is not None and self.peers.get(name) is writer:
+                del self.peers[name]
+                await self._route(self.name, {"op": "peer_left", "to": "*", "peer": name})
+            writer.close()
+            self.connections.discard(asyncio.current_task())
+
+    async def _route(self, sender, frame):
+        frame["from"] = sender
+        frame["routed"] = time.time()
+        destination = frame.get("to")
+        if destination == "*":
+            targets = [writer for name, writer in self.peers.items() if name != sender]
+        elif destination in self.peers:
+            targets = [self.peers[destination]]
+        else:
+            targets = []
+            if frame.get("id") is not None and sender in self.peers:
+                # Fail the request now rather than letting the caller time out
+                frame = {"op": "reply", "from": self.name, "reply_to": frame["id"], "error": f"Unknown peer '{destination}'."}
+                targets = [self.peers[sender]]
+        data = encode_frame(frame)
+        for writer in targets:
+            writer.write(data)
+        for writer in targets:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            for writer in list(self.peers.values()):
+                writer.close()
+            await asyncio.gather(*self.connections, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+            kind, target = parse_address(self.address)
+            if kind == "unix" and os.path.exists(target):
+                os.remove(target)
+
+
+class BusClient:
+    """
+    One peer's connection to the MessageHub.
+
+    post() queues a one-way frame; request() sends a frame with an "id" and waits for the
+    matching reply. Incoming frames are passed to `handler(frame)` in arrival order. A
+    handler that returns a coroutine (for work that itself awaits, such as spawning an
+    agent) runs as its own task, so it cannot hold up the frames behind it. Requests are
+    answered with the handler's return value, or with the error it raised.
+
+    Frames carry the wall clock time they were sent ("sent"); on arrival the sender to hub,
+    hub to receiver and one way latencies, and the round trip of each request, are passed to
+    `hop_logger(peer, leg, seconds)` when one is set. Legs that compare clocks of two hosts
+    are only as accurate as their clock synchronisation; "round_trip" uses ours alone.
+    """
+    def __init__(self, name, address, handler, request_timeout=10.0, token=None):
+        self.name = name
+        self.address = address
+        self.token = token
+        self.handler = handler
+        self.request_timeout = request_timeout
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.pending = {}  # request id -> Future
+        self.handlers = set()  # Tasks running coroutine handlers, cancelled on close
+        self._ids = itertools.count(1)
+        self.peers = set()
+        self.closed = asyncio.Event()
+        self.hop_logger = None  # Called with (peer, leg, seconds) for every timed frame
+
+    async def connect(self, attempts=100, delay=0.1):
+        """Connect and introduce ourselves, retrying while the hub starts up. Returns the peers already connected."""
+        for attempt in range(attempts):
+            try:
+                self.reader, self.writer = await open_connection(self.address)
+                break
+            except (ConnectionError, FileNotFoundError, OSError):
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(delay)
+        hello = {"op": "hello", "from": self.name}
+        if self.token:
+            hello["token"] = self.token
+        self.writer.write(encode_frame(hello))
+        welcome = await read_frame(self.reader)
+        if welcome.get("op") != "welcome":
+            raise BusError(welcome.get("reason", "Connection refused by the message hub."))
+        self.peers = set(welcome.get("peers", []))
+        self.reader_task = asyncio.create_task(self._read_loop())
+        return self.peers
+
+    def post(self, to, op, **payload):
+        """Send a one-way frame; frames from one peer arrive in the order they were posted."""
+        if self.writer is None or self.writer.is_closing():
+            return False
+        self.writer.write(encode_frame({"op": op, "to": to, "sent": time.time(), **payload}))
+        return True
+
+    async def request(self, to, op, timeout=None, **payload):
+        """Send a frame to one peer and return the result of its handler."""
+        request_id = next(self._ids)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending[request_id] = future
+        try:
+            started = loop.time()
+            if not self.post(to, op, id=request_id, **payload):
+                raise BusError("Not connected to the message hub.")
+            await self.writer.drain()
+            result = await asyncio.wait_for(future, timeout or self.request_timeout)
+            if self.hop_logger is not None:
+                self.hop_logger(to, "round_trip", loop.time() - started)
+            return result
+        except asyncio.TimeoutError:
+            raise BusError(f"No reply from '{to}' to '{op}' within {timeout or self.request_timeout}s.")
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                frame = await read_frame(self.reader)
+                if self.hop_logger is not None and "sent" in frame:
+                    self._log_hops(frame)
+                if frame.get("op") == "reply":
+                    future = self.pending.get(frame.get("reply_to"))
+                    if future is not None and not future.done():
+                        if frame.get("error"):
+                            future.set_exception(BusError(frame["error"]))
+                        else:
+                            future.set_result(frame.get("result"))
+                    continue
+                if frame.get("op") == "peer_joined":
+                    self.peers.add(frame["peer"])
+                elif frame.get("op") == "peer_left":
+                    self.peers.discard(frame["peer"])
+                self._dispatch(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(BusError("Connection to the message hub was lost."))
+            self.closed.set()
+
+    def _log_hops(self, frame):
+        received = time.time()
+        peer, sent, routed = frame.get("from"), frame["sent"], frame.get("routed", frame["sent"])
+        self.hop_logger(peer, "to_hub", routed - sent)
+        self.hop_logger(peer, "from_hub", received - routed)
+        self.hop_logger(peer, "one_way", received - sent)
+
+    def _dispatch(self, frame):
+        try:
+            result = self.handler(frame)
+        except Exception as e:
+            self._reply(frame, error=f"{type(e).__name__}: {e}")
+            return
+        if inspect.iscoroutine(result):
+            task = asyncio.create_task(self._finish(frame, result))
+            self.handlers.add(task)
+            task.add_done_callback(self.handlers.discard)
+        else:
+            self._reply(frame, result=result)
+
+    async def _finish(self, frame, coroutine):
+        try:
+            self._reply(frame, result=await coroutine)
+        except Exception as e:
+            self._reply(frame, error=f"{type(e).__name__}: {e}")
+
+    def _reply(self, frame, result=None, error=None):
+        if frame.get("id") is None:
+            if error:
+                print(f"\033[31m{self.name}: '{frame.get('op')}' from {frame.get('from')} failed: {error}\033[0m")
+            return
+        self.post(frame["from"], "reply", reply_to=frame["id"], result=result, error=error)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        tasks = list(self.handlers)
+        if self.reader_task is not None:
+            tasks.append(self.reader_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,86 @@
+import re
+
+from components.token_estimator import estimate_tokens
+
+class ModelRouter:
+    """
+    Picks the model for each task instead of always using the role's gpt_version.
+
+    "tiers" maps a tier name to a model; the special tier "role" is the agent's own
+    gpt_version. "rules" are tried in order and the first match picks the tier; a rule may
+    test the task "type" ("command_output", "message" or "task"), a "match" regex on the
+    description, a list of "priority" levels, and "min_tokens"/"max_tokens" on the
+    description's estimated size. Tasks matching no rule use "default_tier".
+
+    When a response fails to parse (or the optional self-check fails), the task is retried
+    one step up the "escalation" list of tiers. Costs are computed from "prices" per model,
+    in currency units per million prompt/completion tokens.
+    """
+    def __init__(self, config):
+        self.enabled = config.get("enabled", False)
+        self.tiers = config.get("tiers", {})
+        self.escalation = config.get("escalation", list(self.tiers))
+        self.rules = config.get("rules", [])
+        self.default_tier = config.get("default_tier", "role")
+        self.self_check = config.get("self_check", False)
+        self.prices = config.get("prices", {})
+        self.patterns = {}  # regex text -> compiled pattern
+
+    def task_type(self, task):
+        description = task.get("description", "")
+        if description.startswith("Command Output"):
+            return "command_output"
+        if description.startswith("Message from"):
+            return "message"
+        return task.get("type", "task")
+
+    def _matches(self, rule, task):
+        if "type" in rule and rule["type"] != self.task_type(task):
+            return False
+        if "priority" in rule and task.get("priority", "medium") not in rule["priority"]:
+            return False
+        if "match" in rule:
+            pattern = self.patterns.get(rule["match"])
+            if pattern is None:
+                pattern = self.patterns[rule["match"]] = re.compile(rule["match"])
+            if not pattern.search(task.get("description", "")):
+                return False
+        if "min_tokens" in rule or "max_tokens" in rule:
+            size = estimate_tokens(task.get("description", ""))
+            if size < rule.get("min_tokens", 0) or size > rule.get("max_tokens", size):
+                return False
+        return True
+
+    def model_for(self, tier, role_model):
+        if tier == "role" or tier not in self.tiers:
+            return role_model
+        return self.tiers[tier]
+
+    def route(self, task, role_model):
+        """Return (tier, model) for a task."""
+        tier = self.default_tier
+        for rule in self.rules:
+            if self._matches(rule, task):
+                tier = rule["tier"]
+                break
+        return tier, self.model_for(tier, role_model)
+
+    def escalate(self, tier, model, role_model):
+        """Return the (tier, model) to retry on after a failed response, or None at the top."""
+        if tier in self.escalation:
+            position = self.escalation.index(tier)
+            if position + 1 < len(self.escalation):
+                next_tier = self.escalation[position + 1]
+                return next_tier, self.model_for(next_tier, role_model)
+            return None
+        if self.escalation:
+            # Off the ladder (e.g. the role's own model): jump to the strongest tier
+            top = self.escalation[-1]
+            top_model = self.model_for(top, role_model)
+            if top_model != model:
+                return top, top_model
+        return None
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        price = self.prices.get(model, {})
+        return (prompt_tokens * price.get("prompt", 0.0) + completion_tokens * price.get("completion", 0.0)) / 1000000
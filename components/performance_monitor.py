@@ -1,3 +1,4 @@
+from collections import deque
 import time
 
 class PerformanceMonitor:
@@ -10,7 +11,15 @@ class PerformanceMonitor:
             "average_task_duration": 0.0,
             "agent_task_counts": {},  # Tracks task count per agent
             "agent_task_durations": {},  # Tracks total task duration per agent
+            "llm_cache": {"memory_hits": 0, "disk_hits": 0, "misses": 0},  # Response cache counters
+            "llm_gateway": {},  # Per-model gateway counters: calls, retries, failures, breaker trips
+            "llm_usage": {},  # Per-model token totals: calls, prompt, cached and completion tokens
+            "model_routing": {},  # Per-tier calls, escalations, latency and cost
+            "llm_hedging": {},  # Per-model hedged requests: triggered, winners and tail latency saved
+            "message_bus": {},  # Per-peer, per-leg message bus latency: count, total and recent samples
         }
+        self.gauges = {}  # name -> callable returning a value computed when metrics are read
+        self.recent_llm_calls = deque(maxlen=config.get("recent_llm_calls", 20))  # Per-call token usage
 
     def start_simulation_timer(self):
         """Start the simulation runtime timer."""
@@ -22,6 +31,10 @@ class PerformanceMonitor:
             return time.time() - self.start_time
         return 0
 
+    def register_gauge(self, name, read):
+        """Add a metric that is computed on demand (e.g. by the AgentManager) each time metrics are read."""
+        self.gauges[name] = read
+
     def log_task_completion(self, agent_id, task_id, duration):
         """Log a completed task."""
         self.metrics["total_tasks_completed"] += 1
@@ -40,6 +53,71 @@ class PerformanceMonitor:
         self.metrics["agent_task_counts"][agent_id] += 1
         self.metrics["agent_task_durations"][agent_id] += duration
 
+    def log_cache_lookup(self, tier):
+        """Log a response cache lookup; tier is "memory", "disk", or None for a miss."""
+        cache = self.metrics["llm_cache"]
+        if tier is None:
+            cache["misses"] += 1
+        else:
+            cache[f"{tier}_hits"] += 1
+
+    def log_llm_event(self, event, model):
+        """Count an LLM gateway event (e.g. "calls", "retries", "failed_timeout") for a model."""
+        counters = self.metrics["llm_gateway"].setdefault(model, {})
+        counters[event] = counters.get(event, 0) + 1
+
+    def log_llm_usage(self, model, prompt_tokens, completion_tokens, cached_tokens):
+        """Log the token usage of one LLM call; cached_tokens is the prompt prefix the provider served from its cache."""
+        usage = self.metrics["llm_usage"].setdefault(
+            model, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        )
+        usage["calls"] += 1
+        usage["prompt_tokens"] += prompt_tokens
+        usage["cached_tokens"] += cached_tokens
+        usage["completion_tokens"] += completion_tokens
+        self.recent_llm_calls.append(
+            {"model": model, "prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens, "completion_tokens": completion_tokens}
+        )
+
+    def log_hedge(self, model, outcome):
+        """Count a hedging event for a model: "triggered", "hedge_won" or "primary_won"."""
+        stats = self._hedge_stats(model)
+        stats[outcome] += 1
+
+    def log_hedge_saving(self, model, seconds):
+        """Log how much sooner a winning hedge answered than its primary did (or would have, by the deadline)."""
+        stats = self._hedge_stats(model)
+        stats["saved_samples"] += 1
+        stats["saved_seconds"] += seconds
+
+    def _hedge_stats(self, model):
+        return self.metrics["llm_hedging"].setdefault(
+            model, {"triggered": 0, "hedge_won": 0, "primary_won": 0, "saved_samples": 0, "saved_seconds": 0.0}
+        )
+
+    def log_bus_hop(self, peer, leg, seconds):
+        """Log the latency of one message bus leg ("to_hub", "from_hub", "one_way" or "round_trip") for frames from/to a peer."""
+        stats = self.metrics["message_bus"].setdefault(peer, {}).setdefault(
+            leg, {"count": 0, "total": 0.0, "recent": deque(maxlen=self.config.get("bus_latency_window", 1000))}
+        )
+        stats["count"] += 1
+        stats["total"] += seconds
+        stats["recent"].append(seconds)
+
+    def log_model_route(self, tier, model, latency=None, cost=0.0, escalated=False):
+        """Log a routed LLM call (latency in seconds, cost from the router's prices), or an escalation away from a tier."""
+        stats = self.metrics["model_routing"].setdefault(
+            tier, {"models": [], "calls": 0, "escalations": 0, "total_latency": 0.0, "cost": 0.0}
+        )
+        if model not in stats["models"]:
+            stats["models"].append(model)
+        if escalated:
+            stats["escalations"] += 1
+            return
+        stats["calls"] += 1
+        stats["total_latency"] += latency or 0.0
+        stats["cost"] += cost
+
     def get_system_metrics(self):
         """Return a summary of system metrics."""
         runtime = self.stop_simulation_timer() if self.start_time else 0
@@ -49,5 +127,56 @@ class PerformanceMonitor:
             "average_task_duration": self.metrics["average_task_duration"],
             "agent_task_counts": self.metrics["agent_task_counts"],
             "agent_task_durations": self.metrics["agent_task_durations"],
+            "llm_cache": self._cache_summary(),
+            "llm_gateway": self.metrics["llm_gateway"],
+            "llm_usage": self._usage_summary(),
+            "recent_llm_calls": list(self.recent_llm_calls),
+            "model_routing": self._routing_summary(),
+            "llm_hedging": self._hedging_summary(),
+            "message_bus": self._bus_summary(),
+            **{name: read() for name, read in self.gauges.items()},
+        }
+
+    def _cache_summary(self):
+        """Response cache counters plus the overall hit rate."""
+        cache = self.metrics["llm_cache"]
+        hits = cache["memory_hits"] + cache["disk_hits"]
+        lookups = hits + cache["misses"]
+        return {**cache, "hit_rate": hits / lookups if lookups else 0.0}
+
+    def _routing_summary(self):
+        """Per-tier routing counters plus the average latency per call."""
+        return {
+            tier: {**stats, "average_latency": stats["total_latency"] / stats["calls"] if stats["calls"] else 0.0}
+            for tier, stats in self.metrics["model_routing"].items()
+        }
+
+    def _hedging_summary(self):
+        """Hedging counters per model plus the average tail latency saved per winning hedge."""
+        return {
+            model: {**stats, "average_saved": stats["saved_seconds"] / stats["saved_samples"] if stats["saved_samples"] else 0.0}
+            for model, stats in self.metrics["llm_hedging"].items()
+        }
+
+    def _bus_summary(self):
+        """Per-peer bus latency in milliseconds: mean over all frames, p95 and max over the recent window."""
+        summary = {}
+        for peer, legs in self.metrics["message_bus"].items():
+            summary[peer] = {}
+            for leg, stats in legs.items():
+                recent = sorted(stats["recent"])
+                summary[peer][leg] = {
+                    "count": stats["count"],
+                    "mean_ms": 1000 * stats["total"] / stats["count"],
+                    "p95_ms": 1000 * recent[min(len(recent) - 1, int(0.95 * len(recent)))],
+                    "max_ms": 1000 * recent[-1],
+                }
+        return summary
+
+    def _usage_summary(self):
+        """Token totals per model plus the share of prompt tokens served from the provider's prefix cache."""
+        return {
+            model: {**usage, "cached_ratio": usage["cached_tokens"] / usage["prompt_tokens"] if usage["prompt_tokens"] else 0.0}
+            for model, usage in self.metrics["llm_usage"].items()
         }
 
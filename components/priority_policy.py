@@ -0,0 +1,35 @@
+import time
+
+class PriorityPolicy:
+    """
+    Turns a task's "priority" field into a heap key for the TaskQueue and agent inboxes.
+
+    Lower keys are served first. A waiting task ages by one priority level for every
+    `aging_interval` seconds it has been queued, so low priority work is never starved.
+    Since every queued task ages at the same rate, comparing effective levels at any
+    moment is the same as comparing `level * aging_interval + enqueued_at`, which is
+    fixed when the task is queued and can therefore live in a heap.
+    """
+    DEFAULT_LEVELS = {"urgent": 0, "high": 1, "medium": 2, "low": 3}
+
+    def __init__(self, config):
+        self.levels = config.get("priority_levels", self.DEFAULT_LEVELS)
+        self.default_priority = config.get("default_priority", "medium")
+        self.aging_interval = config.get("aging_interval", 30)  # Seconds per level; 0 disables aging
+
+    def level(self, priority):
+        """Return the numeric level for a priority name (numbers are used as-is)."""
+        if isinstance(priority, (int, float)):
+            return priority
+        if priority in self.levels:
+            return self.levels[priority]
+        return self.levels.get(self.default_priority, 0)
+
+    def key(self, task, enqueued_at=None):
+        """Return the heap key for a task queued at `enqueued_at` (defaults to now)."""
+        if enqueued_at is None:
+            enqueued_at = time.monotonic()
+        level = self.level(task.get("priority", self.default_priority))
+        if not self.aging_interval:
+            return (level, enqueued_at)
+        return (level * self.aging_interval + enqueued_at, 0)
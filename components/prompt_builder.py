@@ -0,0 +1,122 @@
+from components.token_estimator import estimate_tokens
+
+
+class PromptBuilder:
+    """
+    Builds agents' system prompts without re-walking the whole organization on every call.
+
+    The command help is cached per (agent class, role) and the rest of an agent's static
+    prompt is cached per agent. The roster ("agent_id (role)" for every agent) is kept in
+    step with AgentManager.roster_version: a spawn appends to the cached text, a
+    termination marks it stale and it is rebuilt once, on the next prompt.
+
+    With agent_manager.prompt_layout "prefix_stable" the system prompt only holds role-wide
+    text (description, commands, hierarchy), byte-identical for every agent of a role, so
+    providers can reuse their cached prefix. The agent ID and roster move into the task
+    message, after the history. The roster is only repeated when it changed since the
+    agent last saw it (or its history was compacted), so turns already in the history, and
+    therefore the cached prefix, stay identical from call to call.
+    """
+    def __init__(self, agent_manager):
+        self.agent_manager = agent_manager
+        self.layout = agent_manager.config.get("prompt_layout", "classic")
+        self.commands_help = {}  # (agent class, role) -> command help text
+        self.role_prompts = {}  # (agent class, role) -> role-wide system prompt (prefix_stable layout)
+        self.roster_seen = {}  # agent_id -> roster version last put in its task message (prefix_stable layout)
+        self.headers = {}  # agent_id -> static part of the agent's system prompt
+        self.roster_entries = {}  # agent_id -> "agent_id (role)", in spawn order
+        self.roster_text = ""
+        self.roster_version = 0  # AgentManager.roster_version that roster_text reflects
+
+    def agent_added(self, agent):
+        """Called by the AgentManager after it registers a new agent and bumps its roster version."""
+        self.entry_added(agent.agent_id, agent.params.get("role", "Unknown Role"))
+
+    def entry_added(self, agent_id, role):
+        """Add an agent (local, or in another shard) to the roster."""
+        entry = f"{agent_id} ({role})"
+        self.roster_entries[agent_id] = entry
+        if self.roster_version == self.agent_manager.roster_version - 1:
+            # The text was current before this spawn, so extend it instead of rebuilding
+            self.roster_text = f"{self.roster_text}, {entry}" if self.roster_text else entry
+            self.roster_version = self.agent_manager.roster_version
+
+    def agent_removed(self, agent_id):
+        """Called by the AgentManager after it removes an agent; the roster text is rebuilt lazily."""
+        self.roster_entries.pop(agent_id, None)
+        self.headers.pop(agent_id, None)
+        self.roster_seen.pop(agent_id, None)
+
+    def release(self, agent_id):
+        """Drop the agent's cached header while it is hibernated; it is rebuilt if the agent comes back."""
+        self.headers.pop(agent_id, None)
+
+    def forget_roster(self, agent_id):
+        """The agent's history may no longer hold the roster (turns summarized or a failed call); send it again."""
+        self.roster_seen.pop(agent_id, None)
+
+    def roster(self):
+        """The current list of agents, e.g. "CEO_1 (CEO), CTO_2 (CTO)"."""
+        if self.roster_version != self.agent_manager.roster_version:
+            self.roster_text = ", ".join(self.roster_entries.values())
+            self.roster_version = self.agent_manager.roster_version
+        return self.roster_text
+
+    def command_help(self, agent):
+        key = (type(agent), agent.params.get("role"))
+        if key not in self.commands_help:
+            self.commands_help[key] = "\n".join(
+                f"{cmd}: {info['description']} (Syntax: {info['syntax']})"
+                for cmd, info in agent.command_definitions.items()
+            )
+        return self.commands_help[key]
+
+    def header(self, agent):
+        """Everything in the system prompt that does not change while the agent lives."""
+        if agent.agent_id not in self.headers:
+            self.headers[agent.agent_id] = (
+                f"You are agent {agent.agent_id}, "
+                f"the {agent.params.get('description', 'role description not provided')}.\n"
+                f"{agent.params.get('prompt', 'act within your capacity')}.\n\n"
+                f"Commands you can execute to help achieve your goals are:\n{self.command_help(agent)}.\n\n"
+                f"Your direct supervisor by role_id is: {agent.params.get('boss', 'None')}.\n"
+                f"Your direct reports by role_id are: {', '.join(agent.subordinates) or 'None'}.\n\n"
+            )
+        return self.headers[agent.agent_id]
+
+    def role_prompt(self, agent):
+        """Role-wide system prompt for the prefix_stable layout; shared by every agent of the role."""
+        key = (type(agent), agent.params.get("role"))
+        if key not in self.role_prompts:
+            self.role_prompts[key] = (
+                f"You are the {agent.params.get('description', 'role description not provided')}.\n"
+                f"{agent.params.get('prompt', 'act within your capacity')}.\n\n"
+                f"Commands you can execute to help achieve your goals are:\n{self.command_help(agent)}.\n\n"
+                f"Your direct supervisor by role_id is: {agent.params.get('boss', 'None')}.\n"
+                f"Your direct reports by role_id are: {', '.join(agent.subordinates) or 'None'}.\n"
+            )
+        return self.role_prompts[key]
+
+    def system_prompt(self, agent):
+        """The agent's system prompt; with the classic layout it includes the current roster."""
+        if self.layout == "prefix_stable":
+            return self.role_prompt(agent)
+        return f"{self.header(agent)}The current list of agents in this organization is: {self.roster()}.\n"
+
+    def context_tokens(self, agent):
+        """Upper bound on the size of context_prompt(), for budgeting before it is built."""
+        if self.layout != "prefix_stable":
+            return 0
+        return estimate_tokens(f"You are agent {agent.agent_id}, acting in the role described above.\n"
+                               f"The current list of agents in this organization is: {self.roster()}.\n")
+
+    def context_prompt(self, agent):
+        """Volatile per-agent text that leads the task message in the prefix_stable layout ("" otherwise)."""
+        if self.layout != "prefix_stable":
+            return ""
+        context = f"You are agent {agent.agent_id}, acting in the role described above.\n"
+        roster = self.roster()
+        if self.roster_seen.get(agent.agent_id) != self.roster_version:
+            self.roster_seen[agent.agent_id] = self.roster_version
+            context += f"The current list of agents in this organization is: {roster}.\n"
+        return context
@@ -0,0 +1,112 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+class ResponseCache:
+    """
+    Content-addressed cache of LLM responses, keyed by a hash of the model and the full message list.
+
+    Lookups try an in-memory LRU tier first, then a persistent SQLite tier; disk hits are promoted
+    to memory. Entries older than `ttl_seconds` are treated as misses (0 or null never expires).
+    """
+    def __init__(self, config):
+        self.memory_entries = config.get("memory_entries", 1024)
+        self.ttl = config.get("ttl_seconds", 86400)
+        self.disk_path = config.get("disk_path", "data/response_cache.db")
+        self.disk_max_entries = config.get("disk_max_entries", 100000)
+        self.memory = OrderedDict()  # key -> (created_at, response), least recently used first
+        self.puts_since_trim = 0
+
+        self.conn = None
+        if self.disk_path:
+            directory = os.path.dirname(self.disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.conn = sqlite3.connect(self.disk_path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created_at)")
+            self.conn.commit()
+
+    @staticmethod
+    def make_key(model, messages):
+        """Hash the model and the exact message list into a cache key."""
+        payload = json.dumps({"model": model, "messages": messages}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at):
+        return bool(self.ttl) and time.time() - created_at > self.ttl
+
+    def get(self, key):
+        """Return (response, tier) where tier is "memory" or "disk", or (None, None) on a miss."""
+        entry = self.memory.get(key)
+        if entry is not None:
+            if not self._expired(entry[0]):
+                self.memory.move_to_end(key)
+                return entry[1], "memory"
+            del self.memory[key]
+
+        if self.conn is not None:
+            row = self.conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and not self._expired(row[1]):
+                self._remember(key, row[1], row[0])
+                return row[0], "disk"
+        return None, None
+
+    def put(self, key, response, model=None):
+        """Store a response in both tiers."""
+        now = time.time()
+        self._remember(key, now, response)
+        if self.conn is not None:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at) VALUES (?, ?, ?, ?)",
+                (key, model, response, now)
+            )
+            self.conn.commit()
+            self.puts_since_trim += 1
+            if self.puts_since_trim >= 100:
+                self._trim_disk()
+
+    def _remember(self, key, created_at, response):
+        """Insert into the memory tier, evicting the least recently used entry if full."""
+        self.memory[key] = (created_at, response)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _trim_disk(self):
+        """Drop expired entries and the oldest ones beyond disk_max_entries."""
+        self.puts_since_trim = 0
+        if self.ttl:
+            self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        count = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.disk_max_entries:
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY created_at LIMIT ?)",
+                (count - self.disk_max_entries,)
+            )
+        self.conn.commit()
+
+    def close(self):
+        """Close the disk tier."""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def create_response_cache(config):
+    """Return a ResponseCache if agent_manager.response_cache.enabled is set, otherwise None."""
+    return ResponseCache(config) if config.get("enabled", False) else None
@@ -0,0 +1,37 @@
+class RoleProfile:
+    """
+    Role-level data shared by every agent spawned with the same class and params, so that
+    a large organization holds one copy per role instead of one per agent: the params
+    dict, the role's meta config, its command whitelist, the streaming flag and the LLM
+    backend (resolved on first use). Treat `params` as read-only; agents share it.
+    """
+    __slots__ = ("params", "role_config", "command_definitions", "streaming", "subordinates", "boss",
+                 "agent_manager", "api_key", "_backend")
+
+    def __init__(self, agent_class, params, api_key, agent_manager, roles_library):
+        self.params = params
+        self.role_config = roles_library.get(params.get("role"), {})
+        self.agent_manager = agent_manager
+        self.api_key = api_key
+        self._backend = None
+        self.boss = params.get("boss", "No direct supervisor")
+        self.subordinates = params.get("subordinates", [])
+        # Commands this role may use: its "commands" whitelist, or all of them ("no_command" is always allowed)
+        allowed = self.role_config.get("commands")
+        if allowed is None:
+            self.command_definitions = agent_class.COMMAND_DEFINITIONS
+        else:
+            self.command_definitions = {
+                cmd: info for cmd, info in agent_class.COMMAND_DEFINITIONS.items() if cmd in allowed or cmd == "no_command"
+            }
+        # Stream completions and run each command line as soon as it arrives (role "streaming" overrides the default)
+        self.streaming = self.role_config.get("streaming", agent_manager.config.get("streaming", False))
+
+    @property
+    def backend(self):
+        """Shared LLM backend: a role may pick one with "llm_backend" and an endpoint with "base_url"."""
+        if self._backend is None:
+            self._backend = self.agent_manager.get_backend(
+                self.role_config.get("llm_backend"), self.api_key, self.role_config.get("base_url")
+            )
+        return self._backend
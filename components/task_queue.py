@@ -1,39 +1,434 @@
+import heapq
+import itertools
+from components.priority_policy import PriorityPolicy
+from components.task_store import create_task_store
+from components.completed_log import CompletedTaskLog
+from components.task_registry import IdAllocator, TaskIndex
+
 class TaskQueue:
     def __init__(self, config):
         self.config = config
-        self.tasks = []  # List of tasks in the queue
-        self.completed_tasks = []  # Store completed tasks for tracking
+        # Global ordering of queued tasks: sequence number -> task (dicts keep insertion order)
+        self.tasks = {}
+        # Priority heaps of (key, sequence number), so agents only ever look at tasks that can be theirs.
+        # Entries are removed lazily: a sequence number no longer in self.tasks is skipped.
+        self.agent_index = {}  # required_agent -> heap of (key, seq)
+        self.role_index = {}  # role -> heap of (key, seq)
+        self.priority_policy = PriorityPolicy(config)
+        self._sequence = itertools.count()
+        # Idle agents waiting for work: notify callbacks keyed by agent ID and by role
+        self.agent_waiters = {}  # agent_id -> (role, notify callback)
+        self.role_waiters = {}  # role -> {agent_id: notify callback}, oldest waiter first
+        # Dependency graph: only tasks whose dependencies have completed are ever queued (the ready set)
+        self.seq_by_id = {}  # task id -> seq for tasks in the ready set
+        self.blocked = {}  # task id -> (task, store row ID) for tasks waiting on dependencies
+        self.waiting_on = {}  # blocked task id -> set of dependency ids not yet completed
+        self.dependents = {}  # task id -> set of blocked task ids waiting on it
+        self.continuations = {}  # in-flight parent id -> blocked continuation task id
+        self.completed_ids = set()  # Tasks that no longer hold up dependents: completed or cancelled
+        self.cancelled_ids = set()  # The cancelled ones, so lookups do not report them as completed
+        # Central ID allocator and id -> container index shared with the agents' inboxes
+        self.ids = IdAllocator()
+        self.index = TaskIndex()
+        self.in_flight = {}  # task id -> (agent_id, store row ID) for tasks handed to agents
+        self.in_flight_priorities = {}  # task id -> priority of tasks handed to agents, inherited by their sub tasks
+        # Sharded organisations: ready tasks no local agent can take are handed to the shard that can
+        self.cluster = None  # ClusterLink, set when this queue is one shard of the organisation
+        self.handed_off = {}  # task id -> peer it was handed to (its row stays in flight until it completes)
+        # Optional durable backend (task_queue.backend = "sqlite"); None keeps everything in memory
+        self.store = create_task_store(config)
+        # Completed tasks go to the store, or to a bounded ring buffer that spills to disk
+        self.completed_tasks = None if self.store else CompletedTaskLog(config)
+        self.row_ids = {}  # seq -> store row ID for queued tasks
+        if self.store:
+            self.completed_ids.update(self.store.completed_task_ids())
+            restored = self.store.load_unfinished()
+            # Never hand out an ID that is already on disk
+            self.ids.advance_past(list(self.completed_ids) + [task.get("id") for _, task in restored])
+            for row_id, task in restored:
+                self._admit(task, row_id)
+            if restored:
+                print(f"Restored {len(restored)} unfinished tasks from {self.store.path}.")
+
+    def new_task_id(self, prefix="task"):
+        """Allocate a new, never repeating task or message ID."""
+        return self.ids.next_id(prefix)
+
+    def use_id_stride(self, offset, stride):
+        """Allocate IDs offset+1, offset+1+stride, ... so that shards never hand out the same ID."""
+        self.ids.restride(offset + 1, stride)
 
     def add_task(self, task):
-        """Add a task to the queue."""
-        self.tasks.append(task)
-        #print(f"Task added: {task}")
+        """Add a task to the queue. Returns False if a task with the same ID is already pending.
+
+        A task with a "depends_on" list of task IDs is held back until all of them have completed.
+        """
+        if "id" not in task:
+            task["id"] = self.new_task_id()
+        task_id = task["id"]
+        if task_id in self.index or task_id in self.in_flight or task_id in self.handed_off:
+            print(f"Task {task_id} is already queued; duplicate ignored.")
+            return False
+        row_id = self.store.insert_task(task) if self.store else None
+        if self.cluster is not None:
+            self.cluster.task_arrived(task_id)
+        if self._admit(task, row_id):
+            #print(f"Task added: {task}")
+            self._wake_waiter_for(task)
+        return True
+
+    def add_subtask(self, parent_id, child_task, continuation_agent=None):
+        """Add a child task that the parent task depends on. Returns the child task.
+
+        If the parent is still queued it is moved out of the ready set until the child completes.
+        If the parent is already being worked on (the usual case: an agent splitting its current
+        task), a continuation task for `continuation_agent` is created instead, so the agent is
+        handed the sub task results once they are all available. The child and the continuation
+        take the parent's priority unless the child sets its own.
+
+        Raises ValueError if the parent is unknown, finished, or in progress and
+        continuation_agent is not the agent working on it.
+        """
+        if parent_id in self.seq_by_id or parent_id in self.blocked:
+            parent_priority = self.get_task(parent_id).get("priority", "medium")
+        elif parent_id in self.in_flight and parent_id not in self.handed_off:
+            holder = self.in_flight[parent_id][0]
+            if continuation_agent != holder:
+                raise ValueError(
+                    f"Task '{parent_id}' is already in progress by {holder}; "
+                    "only the agent working on it can add sub tasks to it."
+                )
+            parent_priority = self.in_flight_priorities.get(parent_id, "medium")
+        else:
+            found = self.lookup_task(parent_id)
+            if found is None:
+                raise ValueError(f"Task '{parent_id}' not found.")
+            raise ValueError(f"Task '{parent_id}' is {found[1]}; sub tasks can only be added to queued or in-progress tasks.")
+
+        if "id" not in child_task:
+            child_task["id"] = self.new_task_id()
+        child_task["parent"] = parent_id
+        child_task.setdefault("priority", parent_priority)
+        child_id = child_task["id"]
+
+        if parent_id in self.seq_by_id or parent_id in self.blocked:
+            self._add_dependency(parent_id, child_id)
+        else:
+            continuation_id = self.continuations.get(parent_id)
+            if continuation_id not in self.blocked:
+                continuation_id = self.new_task_id("continue")
+                self.continuations[parent_id] = continuation_id
+                self.add_task({
+                    "id": continuation_id,
+                    "description": f"Continue task {parent_id} using the results of its sub tasks.",
+                    "priority": parent_priority,
+                    "required_agent": continuation_agent,
+                    "depends_on": [child_id],
+                })
+            else:
+                self._add_dependency(continuation_id, child_id)
+
+        self.add_task(child_task)
+        return child_task
+
+    def _add_dependency(self, task_id, dependency_id):
+        """Make a queued or blocked task wait for another task."""
+        if dependency_id in self.completed_ids:
+            return
+        seq = self.seq_by_id.pop(task_id, None)
+        if seq is not None:
+            # Leave the ready set; stale heap entries are dropped lazily
+            task = self.tasks.pop(seq)
+            self.blocked[task_id] = (task, self.row_ids.pop(seq, None))
+            self.waiting_on[task_id] = set()
+        self.waiting_on[task_id].add(dependency_id)
+        self.dependents.setdefault(dependency_id, set()).add(task_id)
+
+        # Record the new edge on the task itself so it survives a restart
+        task, row_id = self.blocked[task_id]
+        task["depends_on"] = list(task.get("depends_on") or []) + [dependency_id]
+        if row_id is not None:
+            self.store.update_task(row_id, task)
+
+    def _admit(self, task, row_id=None):
+        """Queue a task if its dependencies are met, otherwise block it. Returns True if queued."""
+        unresolved = {dep for dep in task.get("depends_on") or [] if dep not in self.completed_ids}
+        if not unresolved:
+            self._enqueue(task, row_id)
+            return True
+        task_id = task["id"]
+        self.index.add(task_id, self)
+        self.blocked[task_id] = (task, row_id)
+        self.waiting_on[task_id] = unresolved
+        for dep in unresolved:
+            self.dependents.setdefault(dep, set()).add(task_id)
+            if self.cluster is not None and not self.ids.owns(dep):
+                self.cluster.watch(dep)  # Another shard's task: ask to be told when it completes
+        return False
+
+    def _enqueue(self, task, row_id=None):
+        """Place a ready task in the global ordering and the agent/role indexes."""
+        if self.cluster is not None:
+            peer = self.cluster.task_owner(task)
+            if peer is not None:
+                self._hand_off(task, row_id, peer)
+                return
+        seq = next(self._sequence)
+        self.tasks[seq] = task
+        if "id" in task:
+            self.seq_by_id[task["id"]] = seq
+            self.index.add(task["id"], self)
+        entry = (self.priority_policy.key(task), seq)
+        if task.get("required_agent") is not None:
+            heapq.heappush(self.agent_index.setdefault(task["required_agent"], []), entry)
+        if task.get("role") is not None:
+            heapq.heappush(self.role_index.setdefault(task["role"], []), entry)
+        if row_id is not None:
+            self.row_ids[seq] = row_id
+
+    def register_waiter(self, agent_id, role, notify):
+        """Register an idle agent to be notified when a task it can take is added."""
+        self.agent_waiters[agent_id] = (role, notify)
+        if role is not None:
+            self.role_waiters.setdefault(role, {})[agent_id] = notify
+
+    def unregister_waiter(self, agent_id, role, notify=None):
+        """Remove an agent from the waiter registries (only if its callback is still `notify`, when given)."""
+        if notify is not None:
+            registered = self.agent_waiters.get(agent_id)
+            if registered is None or registered[1] != notify:
+                return
+        self.agent_waiters.pop(agent_id, None)
+        waiters = self.role_waiters.get(role)
+        if waiters is not None:
+            waiters.pop(agent_id, None)
+            if not waiters:
+                del self.role_waiters[role]
+
+    def _wake_waiter_for(self, task):
+        """Wake a single idle agent that can take the task, preferring the required agent."""
+        agent_id = task.get("required_agent")
+        if agent_id is None or agent_id not in self.agent_waiters:
+            waiters = self.role_waiters.get(task.get("role"))
+            if not waiters:
+                return
+            agent_id = next(iter(waiters))
+        role, notify = self.agent_waiters[agent_id]
+        self.unregister_waiter(agent_id, role)
+        notify()
+
+    def _peek_index(self, index, key):
+        """Return the most urgent live (key, seq) entry in an index bucket, dropping stale ones."""
+        bucket = index.get(key)
+        if bucket is None:
+            return None
+        while bucket and bucket[0][1] not in self.tasks:
+            heapq.heappop(bucket)
+        if not bucket:
+            del index[key]
+            return None
+        return bucket[0]
+
+    def _hand_off(self, task, row_id, peer):
+        """Pass a ready task to another shard; it counts as in flight here until that shard reports it done."""
+        if "id" in task:
+            self.index.discard(task["id"], self)
+            self.handed_off[task["id"]] = peer
+            self.in_flight[task["id"]] = (None, row_id)
+        if row_id is not None:
+            self.store.mark_in_flight(row_id)
+        self.cluster.hand_off(peer, task)
+
+    def has_task_for(self, agent_id, role):
+        """Whether a task matching the agent's ID or role is waiting, without taking it."""
+        return self._peek_index(self.agent_index, agent_id) is not None or self._peek_index(self.role_index, role) is not None
 
     def fetch_task_for_agent(self, agent_id, role):
         """Fetch the next task matching the agent's ID or role."""
-        for task in self.tasks:
-            #print(f"Checking task {task['id']} for {agent_id} (Role: {role})...")
-            if task.get("required_agent") == agent_id or task.get("role") == role:
-                self.tasks.remove(task)
-                #print(f"Task {task['id']} assigned to {agent_id} (Role: {role})")
-                return task
-        #print(f"No tasks available for {agent_id} (Role: {role})")
-        return None
+        agent_entry = self._peek_index(self.agent_index, agent_id)
+        role_entry = self._peek_index(self.role_index, role)
+        if agent_entry is None and role_entry is None:
+            #print(f"No tasks available for {agent_id} (Role: {role})")
+            return None
 
-    def mark_task_completed(self, task, agent_id):
-        """Mark a task as completed."""
-        self.completed_tasks.append({**task, "completed_by": agent_id})
+        # Most urgent (aged) matching task wins, whichever index it came from
+        if role_entry is None or (agent_entry is not None and agent_entry < role_entry):
+            _, seq = heapq.heappop(self.agent_index[agent_id])
+        else:
+            _, seq = heapq.heappop(self.role_index[role])
+        task = self.tasks.pop(seq)
+        if self.seq_by_id.get(task.get("id")) == seq:
+            del self.seq_by_id[task["id"]]
+            self.index.discard(task["id"], self)
+        row_id = self.row_ids.pop(seq, None)
+        if row_id is not None:
+            self.store.mark_in_flight(row_id)
+        if "id" in task:
+            self.in_flight[task["id"]] = (agent_id, row_id)
+            self.in_flight_priorities[task["id"]] = task.get("priority", "medium")
+        #print(f"Task {task['id']} assigned to {agent_id} (Role: {role})")
+        return task
+
+    def mark_task_completed(self, task, agent_id, result=None):
+        """Mark a task as completed and release any tasks that were waiting on it."""
+        entry = {**task, "completed_by": agent_id}
+        if self.store:
+            # Completed tasks live on disk only; query them with get_completed_tasks()
+            self.store.mark_completed(self.in_flight.get(task.get("id"), (None, None))[1], entry)
+        else:
+            self.completed_tasks.append(entry)
         #print(f"Task {task['id']} completed by {agent_id}")
+        if "id" in task:
+            self.in_flight.pop(task["id"], None)
+            self.in_flight_priorities.pop(task["id"], None)
+            self._resolve_dependency(task["id"], result)
+            if self.cluster is not None:
+                self.cluster.task_completed(task, agent_id, result)
+
+    def remote_task_completed(self, task_id, agent_id, result, cancelled=False):
+        """Another shard finished (or cancelled) a task we handed to it, or one we are watching."""
+        if task_id in self.completed_ids:
+            return
+        if cancelled:
+            self.cancelled_ids.add(task_id)
+        if self.handed_off.pop(task_id, None) is not None:
+            _, row_id = self.in_flight.pop(task_id, (None, None))
+            if row_id is not None:
+                self.store.mark_completed(row_id, {"id": task_id, "completed_by": agent_id})
+            if self.cluster is not None:
+                # Shards that watched it here, where it was queued, are waiting on us
+                self.cluster.task_completed({"id": task_id}, agent_id, result, cancelled)
+        self._resolve_dependency(task_id, result)
+
+    def _resolve_dependency(self, task_id, result):
+        """Incrementally update the ready set after a task completes."""
+        self.completed_ids.add(task_id)
+        for dependent_id in self.dependents.pop(task_id, ()):
+            task, row_id = self.blocked[dependent_id]
+            if result is not None:
+                # Results gathered so far travel with the task, so a restart does not lose them
+                task.setdefault("inputs", {})[task_id] = result
+                if row_id is not None:
+                    self.store.update_task(row_id, task)
+            waiting = self.waiting_on[dependent_id]
+            waiting.discard(task_id)
+            if waiting:
+                continue
+            del self.waiting_on[dependent_id]
+            del self.blocked[dependent_id]
+            self._enqueue(task, row_id)
+            self._wake_waiter_for(task)
+
+    def lookup_task(self, task_id):
+        """Find a task anywhere in the organisation. Returns (task, location) or None."""
+        container = self.index.get(task_id)
+        if container is not None:
+            return container.get_task(task_id), container.describe(task_id)
+        if task_id in self.handed_off:
+            return None, f"handed to {self.handed_off[task_id]}"
+        if task_id in self.in_flight:
+            agent_id, _ = self.in_flight[task_id]
+            return None, f"in progress by {agent_id}"
+        if task_id in self.cancelled_ids:
+            return None, "cancelled"
+        if task_id in self.completed_ids:
+            return None, "completed"
+        return None
+
+    def cancel_task(self, task_id):
+        """Cancel a queued, blocked or inbox task. Returns the cancelled task, or None."""
+        container = self.index.get(task_id)
+        return container.cancel(task_id) if container is not None else None
 
-    def get_completed_tasks(self):
-        """Return all completed tasks."""
-        return self.completed_tasks
+    def reprioritize_task(self, task_id, priority):
+        """Change the priority of a queued, blocked or inbox task. Returns the task, or None."""
+        container = self.index.get(task_id)
+        return container.reprioritize(task_id, priority) if container is not None else None
+
+    # Container interface used by the TaskIndex (see components/task_registry.py)
+
+    def get_task(self, task_id):
+        """Return a task held by the queue, ready or blocked."""
+        if task_id in self.seq_by_id:
+            return self.tasks[self.seq_by_id[task_id]]
+        return self.blocked[task_id][0]
+
+    def describe(self, task_id):
+        """Describe where the queue holds a task."""
+        if task_id in self.blocked:
+            return f"blocked on {', '.join(str(dep) for dep in self.waiting_on[task_id])}"
+        return "queued"
+
+    def cancel(self, task_id):
+        """Remove a task from the queue. Tasks waiting on it are released without its result."""
+        self.index.discard(task_id, self)
+        seq = self.seq_by_id.pop(task_id, None)
+        if seq is not None:
+            task = self.tasks.pop(seq)  # Heap entries are dropped lazily
+            row_id = self.row_ids.pop(seq, None)
+        else:
+            task, row_id = self.blocked.pop(task_id)
+            for dep in self.waiting_on.pop(task_id):
+                self.dependents[dep].discard(task_id)
+        if row_id is not None:
+            self.store.mark_cancelled(row_id)
+        self.cancelled_ids.add(task_id)
+        self._resolve_dependency(task_id, "This sub task was cancelled.")
+        if self.cluster is not None:
+            self.cluster.task_completed(task, None, "This sub task was cancelled.", cancelled=True)
+        return task
+
+    def reprioritize(self, task_id, priority):
+        """Change a task's priority; a ready task is re-queued under its new priority."""
+        task = self.get_task(task_id)
+        task["priority"] = priority
+        seq = self.seq_by_id.pop(task_id, None)
+        if seq is not None:
+            self.tasks.pop(seq)  # Old heap entries become stale
+            self._enqueue(task, self.row_ids.pop(seq, None))
+        row_id = self.row_ids.get(self.seq_by_id.get(task_id)) if seq is not None else self.blocked[task_id][1]
+        if row_id is not None:
+            self.store.update_task(row_id, task)
+        return task
+
+    def get_completed_tasks(self, agent_id=None, limit=None):
+        """Lazily iterate over completed tasks, optionally only those completed by one agent.
+
+        Entries are streamed from disk (the SQLite store or the spill segment) as well as memory.
+        """
+        if self.store:
+            return self.store.iter_completed(agent_id, limit)
+        completed = (t for t in self.completed_tasks if agent_id is None or t["completed_by"] == agent_id)
+        return itertools.islice(completed, limit)
 
     def get_all_tasks(self):
-        """Return all tasks."""
-        return self.tasks
+        """Return all tasks: the ready set first, then tasks blocked on dependencies."""
+        return list(self.tasks.values()) + [task for task, _ in self.blocked.values()]
+
+    def pending_count(self):
+        """Number of tasks get_all_tasks() would return, without building the list."""
+        return len(self.tasks) + len(self.blocked)
 
     def flush_tasks(self):
         """Flush all tasks in the queue."""
         self.tasks.clear()
+        self.agent_index.clear()
+        self.role_index.clear()
+        self.row_ids.clear()
+        for task_id in list(self.seq_by_id) + list(self.blocked):
+            self.index.discard(task_id, self)
+        self.seq_by_id.clear()
+        self.blocked.clear()
+        self.waiting_on.clear()
+        self.dependents.clear()
+        self.continuations.clear()
+        if self.store:
+            self.store.delete_pending()
         print("All tasks have been flushed.")
+
+    def close(self):
+        """Commit and close the persistent backend, or flush the completed-task spill."""
+        if self.store:
+            self.store.close()
+        else:
+            self.completed_tasks.flush()
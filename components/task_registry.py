@@ -0,0 +1,80 @@
+import itertools
+import re
+
+class IdAllocator:
+    """
+    Central source of task and message IDs.
+
+    A single monotonic counter is shared by every prefix, so IDs never repeat
+    within a run, even after queues drain ("msg-12", "task-13", ...).
+    """
+    def __init__(self, start=1, step=1):
+        self.start = start
+        self.step = step  # Shards each take every step-th number, offset by their index
+        self._counter = itertools.count(start, step)
+        self._last = start - step
+
+    def next_id(self, prefix="task"):
+        """Return a new, never used ID with the given prefix."""
+        self._last = next(self._counter)
+        return f"{prefix}-{self._last}"
+
+    def restride(self, start, step):
+        """Switch to the sequence start, start+step, ... (a shard's share), above every number handed out so far."""
+        last = self._last
+        self.start = start
+        self.step = step
+        self._counter = itertools.count(start, step)
+        self._last = start - step
+        self._advance_to(last)
+
+    def advance_past(self, ids):
+        """Skip past existing "<prefix>-<n>" IDs (e.g. tasks restored from disk) so they are not reused."""
+        highest = self._last
+        for task_id in ids:
+            number = self._number(task_id)
+            if number is not None:
+                highest = max(highest, number)
+        self._advance_to(highest)
+
+    def _advance_to(self, highest):
+        if highest > self._last:
+            # Next number in our own sequence above the highest one seen
+            following = highest + 1 + (self.start - highest - 1) % self.step
+            self._counter = itertools.count(following, self.step)
+            self._last = following - self.step
+
+    def owns(self, task_id):
+        """Whether an ID comes from this allocator's sequence (with sharding, from this shard)."""
+        number = self._number(task_id)
+        return number is not None and (number - self.start) % self.step == 0
+
+    @staticmethod
+    def _number(task_id):
+        match = re.search(r"-(\d+)$", str(task_id))
+        return int(match.group(1)) if match else None
+
+
+class TaskIndex:
+    """
+    Maps a task ID to the container currently holding it: the TaskQueue or an agent's inbox.
+
+    Containers implement get_task(task_id), cancel(task_id), reprioritize(task_id, priority)
+    and describe(task_id), so any queued task can be looked up, cancelled or re-prioritized in O(1).
+    """
+    def __init__(self):
+        self.locations = {}
+
+    def add(self, task_id, container):
+        self.locations[task_id] = container
+
+    def discard(self, task_id, container):
+        """Forget a task, but only if it is still recorded against this container."""
+        if self.locations.get(task_id) is container:
+            del self.locations[task_id]
+
+    def get(self, task_id):
+        return self.locations.get(task_id)
+
+    def __contains__(self, task_id):
+        return task_id in self.locations
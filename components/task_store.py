@@ -0,0 +1,154 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+
+class SQLiteTaskStore:
+    """
+    Durable backing store for the TaskQueue, kept in SQLite in WAL mode.
+
+    Every queued task is a row whose status moves pending -> in_flight -> completed.
+    Writes are committed in batches (every `commit_batch_size` writes, or at most
+    `commit_interval` seconds after the first uncommitted write), so a crash loses
+    at most one batch. Completed tasks stay on disk and are streamed on request.
+    """
+    def __init__(self, config):
+        self.path = config.get("sqlite_path", "data/task_queue.db")
+        self.commit_batch_size = config.get("commit_batch_size", 50)
+        self.commit_interval = config.get("commit_interval", 1.0)
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS tasks (
+                row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT NOT NULL,
+                task TEXT NOT NULL,
+                completed_by TEXT,
+                completed_at REAL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, row_id)")
+        self.conn.commit()
+
+        self.uncommitted_writes = 0
+        self.commit_scheduled = False
+        self.closed = False
+
+    def insert_task(self, task):
+        """Persist a newly queued task and return its row ID."""
+        cursor = self.conn.execute(
+            "INSERT INTO tasks (status, task) VALUES ('pending', ?)",
+            (json.dumps(task, default=str),)
+        )
+        self._wrote()
+        return cursor.lastrowid
+
+    def update_task(self, row_id, task):
+        """Rewrite a queued task (e.g. after a dependency was added to it)."""
+        self.conn.execute("UPDATE tasks SET task = ? WHERE row_id = ?", (json.dumps(task, default=str), row_id))
+        self._wrote()
+
+    def mark_in_flight(self, row_id):
+        """Record that a task has been handed to an agent."""
+        self.conn.execute("UPDATE tasks SET status = 'in_flight' WHERE row_id = ?", (row_id,))
+        self._wrote()
+
+    def mark_cancelled(self, row_id):
+        """Record that a queued task was cancelled; it will not be restored."""
+        self.conn.execute("UPDATE tasks SET status = 'cancelled' WHERE row_id = ?", (row_id,))
+        self._wrote()
+
+    def mark_completed(self, row_id, entry):
+        """Store the completed task entry. Tasks not queued through the store get a new row."""
+        payload = (json.dumps(entry, default=str), entry.get("completed_by"), time.time())
+        if row_id is None:
+            self.conn.execute(
+                "INSERT INTO tasks (status, task, completed_by, completed_at) VALUES ('completed', ?, ?, ?)",
+                payload
+            )
+        else:
+            self.conn.execute(
+                "UPDATE tasks SET status = 'completed', task = ?, completed_by = ?, completed_at = ? WHERE row_id = ?",
+                payload + (row_id,)
+            )
+        self._wrote()
+
+    def delete_pending(self):
+        """Remove every task that has not been picked up yet."""
+        self.conn.execute("DELETE FROM tasks WHERE status = 'pending'")
+        self.commit()
+
+    def load_unfinished(self):
+        """Return (row_id, task) for pending and in-flight tasks, re-queuing the in-flight ones."""
+        self.conn.execute("UPDATE tasks SET status = 'pending' WHERE status = 'in_flight'")
+        self.commit()
+        rows = self.conn.execute(
+            "SELECT row_id, task FROM tasks WHERE status = 'pending' ORDER BY row_id"
+        )
+        return [(row_id, json.loads(task)) for row_id, task in rows]
+
+    def iter_completed(self, agent_id=None, limit=None):
+        """Stream completed task entries from disk, oldest first, optionally for one agent."""
+        query = "SELECT task FROM tasks WHERE status = 'completed'"
+        params = []
+        if agent_id is not None:
+            query += " AND completed_by = ?"
+            params.append(agent_id)
+        query += " ORDER BY completed_at, row_id"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        for (task,) in self.conn.execute(query, params):
+            yield json.loads(task)
+
+    def completed_task_ids(self):
+        """Return the IDs of all completed tasks (used to resolve dependencies after a restart)."""
+        rows = self.conn.execute("SELECT json_extract(task, '$.id') FROM tasks WHERE status = 'completed'")
+        return [task_id for (task_id,) in rows if task_id is not None]
+
+    def count_completed(self):
+        """Return the number of completed tasks on disk."""
+        return self.conn.execute("SELECT COUNT(*) FROM tasks WHERE status = 'completed'").fetchone()[0]
+
+    def _wrote(self):
+        """Commit once a batch is full, otherwise make sure a timed commit is pending."""
+        self.uncommitted_writes += 1
+        if self.uncommitted_writes >= self.commit_batch_size:
+            self.commit()
+        elif not self.commit_scheduled:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return  # No event loop (e.g. start-up); the next batch or close() commits
+            self.commit_scheduled = True
+            loop.call_later(self.commit_interval, self.commit)
+
+    def commit(self):
+        """Commit outstanding writes."""
+        self.commit_scheduled = False
+        if self.uncommitted_writes and not self.closed:
+            self.conn.commit()
+            self.uncommitted_writes = 0
+
+    def close(self):
+        """Commit outstanding writes and close the database."""
+        self.commit()
+        self.closed = True
+        self.conn.close()
+
+
+def create_task_store(config):
+    """Return the persistent store selected by task_queue.backend, or None for in-memory only."""
+    backend = config.get("backend", "memory")
+    if backend == "sqlite":
+        return SQLiteTaskStore(config)
+    if backend != "memory":
+        print(f"Unknown task_queue backend '{backend}', keeping tasks in memory.")
+    return None
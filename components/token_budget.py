@@ -0,0 +1,109 @@
+from components.llm_gateway import LLMGatewayError
+from components.token_estimator import estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+
+
+class TokenBudget:
+    """
+    Per-model token limits for agents' conversation windows, and the summarizer that
+    compacts turns which no longer fit.
+
+    Limits come from "limits" {"default": {...}, "<model>": {...}}:
+      - max_prompt_tokens: ceiling for a whole request (system prompt, summary, history, task)
+      - history_tokens: most recent turns kept verbatim
+      - summary_tokens: size of the rolling summary of older turns
+      - max_message_tokens: any single message (e.g. an internet_fetch result) is clipped to this
+    "summarizer" is "extractive" (local, no LLM call) or "model", which asks "summary_model"
+    through the LLMGateway and falls back to extractive if that call fails.
+    """
+    DEFAULT_LIMITS = {
+        "max_prompt_tokens": 12000,
+        "history_tokens": 6000,
+        "summary_tokens": 600,
+        "max_message_tokens": 3000,
+    }
+    EXTRACT_CHARS = 200  # Per summarized message, for the extractive summarizer
+    CLIP_MARKER_TOKENS = 16  # Room left for the "[... omitted ...]" line, so clipped text stays within its limit
+    MIN_SYSTEM_PROMPT_TOKENS = 200  # A system prompt clipped below this is useless; the request is refused instead
+
+    def __init__(self, config, llm_gateway=None):
+        self.config = config
+        self.llm_gateway = llm_gateway
+        self.limits_config = config.get("limits", {})
+        self.summarizer = config.get("summarizer", "extractive")
+        self.summary_model = config.get("summary_model", "gpt-4o-mini")
+        self.limits_by_model = {}
+
+    def limits(self, model):
+        if model not in self.limits_by_model:
+            limits = dict(self.DEFAULT_LIMITS)
+            limits.update(self.limits_config.get("default", {}))
+            limits.update(self.limits_config.get(model, {}))
+            self.limits_by_model[model] = limits
+        return self.limits_by_model[model]
+
+    def fit_system_prompt(self, system_prompt, task_tokens, model):
+        """Clip the system prompt to what the task message and summary leave under max_prompt_tokens.
+
+        Raises LLMGatewayError("prompt_too_large") when too little room is left for it to be useful.
+        """
+        limits = self.limits(model)
+        room = limits["max_prompt_tokens"] - task_tokens - limits["summary_tokens"] - 3 * MESSAGE_OVERHEAD_TOKENS
+        if estimate_tokens(system_prompt) <= room:
+            return system_prompt
+        if room < self.MIN_SYSTEM_PROMPT_TOKENS:
+            raise LLMGatewayError(
+                "prompt_too_large",
+                f"The task message ({task_tokens} tokens) leaves only {room} tokens for the system prompt "
+                f"under max_prompt_tokens ({limits['max_prompt_tokens']}).",
+                model=model,
+            )
+        print(f"\033[33mSystem prompt clipped to {room} tokens to stay under max_prompt_tokens for {model}.\033[0m")
+        return self.clip(system_prompt, room)
+
+    def clip(self, text, max_tokens):
+        """Shorten text to about max_tokens, keeping its head and tail."""
+        if estimate_tokens(text) <= max_tokens:
+            return text
+        keep = max(0, max_tokens - self.CLIP_MARKER_TOKENS) * 4 // 2
+        omitted = estimate_tokens(text[keep:-keep])
+        return f"{text[:keep]}\n[... about {omitted} tokens omitted ...]\n{text[-keep:]}"
+
+    async def summarize(self, summary, messages, model, backend=None):
+        """Fold messages into the rolling summary and return the new summary."""
+        limit = self.limits(model)["summary_tokens"]
+        if self.summarizer == "model" and self.llm_gateway and backend:
+            try:
+                return await self._model_summary(summary, messages, limit, backend)
+            except LLMGatewayError as e:
+                print(f"\033[33mConversation summary via {self.summary_model} failed ({e.kind}); using extractive summary.\033[0m")
+        return self._extractive_summary(summary, messages, limit)
+
+    def _extractive_summary(self, summary, messages, limit):
+        """Keep the opening of each message, one line per message, dropping the oldest lines past the limit."""
+        lines = summary.splitlines() if summary else []
+        for message in messages:
+            opening = " ".join((message.get("content") or "")[:self.EXTRACT_CHARS * 2].split())[:self.EXTRACT_CHARS]
+            lines.append(f"- {message['role']}: {opening}")
+        total = sum(estimate_tokens(line) + 1 for line in lines)
+        start = 0
+        while total > limit and start < len(lines) - 1:
+            total -= estimate_tokens(lines[start]) + 1
+            start += 1
+        return "\n".join(lines[start:])
+
+    async def _model_summary(self, summary, messages, limit, backend):
+        turns = "\n".join(f"{m['role']}: {m.get('content') or ''}" for m in messages)
+        prompt = (
+            f"Previous summary:\n{summary or 'None'}\n\n"
+            f"New conversation turns:\n{turns}\n\n"
+            f"Write an updated summary in at most {limit} tokens. Keep decisions, commitments, "
+            "open questions and any agent or task IDs. Reply with the summary only."
+        )
+        conversation = [
+            {"role": "system", "content": "You compress an agent's conversation history into a short running summary."},
+            {"role": "user", "content": prompt},
+        ]
+        result = await self.llm_gateway.chat(backend, self.summary_model, conversation)
+        if not result.content:
+            raise LLMGatewayError("empty_response", "The summary model returned no content.", model=self.summary_model, attempts=1)
+        return self.clip(result.content.strip(), limit)
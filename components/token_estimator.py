@@ -0,0 +1,11 @@
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators added by the chat format
+
+
+def estimate_tokens(text):
+    """Fast local token estimate (about four characters per token); no tokenizer needed."""
+    return (len(text or "") + 3) // 4
+
+
+def estimate_message_tokens(messages):
+    """Estimated prompt size of a list of chat messages."""
+    return sum(estimate_tokens(m.get("content")) + MESSAGE_OVERHEAD_TOKENS for m in messages)
@@ -0,0 +1,89 @@
+import asyncio
+from collections import deque
+
+class WorkerPool:
+    """
+    Runs agents' tasks on a fixed number of worker coroutines instead of one activity
+    loop per agent, so concurrency (and in-flight LLM calls) follows "workers" rather
+    than headcount.
+
+    An agent with work is put on the ready queue once; a worker takes it, runs one task
+    (inbox first, then the task queue, as the activity loop would) and puts it back at
+    the end of the queue if more work is waiting. An agent is never on two workers at
+    once, so its tasks run one at a time and in order. Agents without work are registered
+    as task queue waiters and are scheduled again by their notify().
+    """
+    def __init__(self, config, agent_manager, task_queue, performance_monitor):
+        self.size = config.get("workers", 32)
+        self.agent_manager = agent_manager
+        self.task_queue = task_queue
+        self.ready = deque()  # Agent IDs waiting for a worker, oldest first
+        self.scheduled = set()  # Agent IDs on the ready queue or on a worker
+        self.ready_event = asyncio.Event()
+        self.workers = []
+        self.busy = 0
+        self.tasks_run = 0
+        performance_monitor.register_gauge("worker_pool", self.stats)
+
+    def start(self):
+        """Start the workers (on first use, from inside the event loop)."""
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._worker(n)) for n in range(self.size)]
+
+    def schedule(self, agent_id):
+        """Queue an agent that may have work; a no-op while it is already queued or running."""
+        if agent_id in self.scheduled:
+            return
+        agent = self.agent_manager.agents.get(agent_id)
+        if agent is None:
+            return
+        self.start()
+        self.scheduled.add(agent_id)
+        if agent.idle_since is not None:
+            agent.idle_since = None
+            self.task_queue.unregister_waiter(agent_id, agent.params.get("role"), agent.notify)
+        self.ready.append(agent_id)
+        self.ready_event.set()
+
+    def remove(self, agent):
+        """Forget a terminated agent."""
+        self.task_queue.unregister_waiter(agent.agent_id, agent.params.get("role"), agent.notify)
+        if agent.agent_id in self.ready:
+            self.ready.remove(agent.agent_id)
+            self.scheduled.discard(agent.agent_id)
+
+    async def _worker(self, number):
+        while True:
+            while not self.ready:
+                self.ready_event.clear()
+                await self.ready_event.wait()
+            agent_id = self.ready.popleft()
+            agent = self.agent_manager.agents.get(agent_id)
+            task = None
+            if agent is not None and agent.active and agent.state != "Hibernated":
+                task = agent.next_task()
+            if task:
+                self.busy += 1
+                try:
+                    await agent.perform_task(task)
+                except Exception as e:
+                    print(f"Error in worker {number} running {agent_id}: {e}")
+                finally:
+                    self.busy -= 1
+                    self.tasks_run += 1
+            self.scheduled.discard(agent_id)
+            if self.agent_manager.agents.get(agent_id) is not agent or not agent.active or agent.state == "Hibernated":
+                continue  # Terminated, hibernated or paused
+            if agent.has_work():
+                self.schedule(agent_id)  # Back of the queue, so other agents get their turn
+            else:
+                self.task_queue.register_waiter(agent_id, agent.params.get("role"), agent.notify)
+                agent.idle_since = asyncio.get_running_loop().time()
+
+    def stats(self):
+        return {"workers": self.size, "busy": self.busy, "ready": len(self.ready), "tasks_run": self.tasks_run}
+
+    def close(self):
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
@@ -2,13 +2,17 @@ import json
 import asyncio
 import aioconsole
 import os
+import sys
 import argparse
+import signal
 from components.agent_manager import AgentManager
 from components.task_queue import TaskQueue
 from components.performance_monitor import PerformanceMonitor
 from components.communication_layer import CommunicationLayer
 from components.global_context import GlobalContext
 from components.command_processor import CommandProcessor
+from components.cluster import ClusterLink
+from components.message_bus import TOKEN_ENV, MessageHub
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -20,6 +24,19 @@ if __name__ == "__main__":
         default="config/meta_config.json",
         help="Path to the meta configuration file."
     )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="config/default_config.json",
+        help="Path to the configuration file."
+    )
+    parser.add_argument("--node", type=int, default=None, help="Node mode: this node's index (overrides cluster.node_index).")
+    parser.add_argument("--nodes", type=int, default=None, help="Node mode: number of nodes (overrides cluster.nodes).")
+    parser.add_argument("--broker", type=str, default=None, help="Node mode: message broker address (overrides cluster.broker_address).")
+    # Used by the sharded controller to start its shard processes
+    parser.add_argument("--shard", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--shards", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--bus", type=str, default=None, help=argparse.SUPPRESS)
     args = parser.parse_args()
 
 class SimulationController:
@@ -43,6 +60,11 @@ class SimulationController:
         self.task_queue = None
         self.performance_monitor = None
         self.communication_layer = None
+        self.cluster = None  # ClusterLink when the organisation is sharded across processes or nodes
+        self.forward_control = False  # Pass pause/resume/stop/flush on to the other peers
+        self.message_hub = None
+        self.shard_processes = []
+        self.shutdown_event = None
         
         # 3) Build the global context using the newly populated roles_library
         self.global_context = GlobalContext(
@@ -89,7 +111,29 @@ class SimulationController:
 
         self.initializing = True
         print("Initializing simulation environment...")
+        mode = self.config.get("cluster", {}).get("mode", "single")
+        if mode == "node":
+            self.use_shard_paths(f"node-{self.config['cluster'].get('node_index', 0)}")  # Nodes may share a host
+        self.create_components()
+
+        try:
+            if mode == "sharded":
+                await self.start_shards()
+            elif mode == "node":
+                await self.join_nodes()
+            if mode != "node" or self.cluster.index == 0:
+                # One node creates the organisation; placement spreads it over the others
+                await self.initialize_agents()  # Spawn initial agents
+                self.assign_initial_tasks()
+            print("Simulation environment initialized.")
+            self.running = True
+        except Exception as e:
+            print(f"Error during initialization: {e}")
+        finally:
+            self.initializing = False
 
+    def create_components(self):
+        """Create the task queue, agent manager and the other shared services."""
         self.performance_monitor = PerformanceMonitor(self.config.get("performance_monitor", {}))
         api_key = os.getenv("OPENAI_API_KEY")
         self.task_queue = TaskQueue(self.config.get("task_queue", {}))
@@ -111,15 +155,130 @@ class SimulationController:
         self.global_context.performance_monitor = self.performance_monitor
         self.global_context.communication_layer = self.communication_layer
 
+    async def start_shards(self):
+        """
+        Sharded mode: start the message hub and one process per shard, and join them as the
+        coordinator. The shards host the agents; this process keeps the CLI and forwards
+        spawns, tasks and messages to them, so the CLI still sees one organisation.
+        """
+        cluster_config = self.config.get("cluster", {})
+        count = cluster_config.get("shards") or os.cpu_count() or 1
+        address = cluster_config.get("address", "unix:data/message_bus.sock")
+        self.message_hub = await MessageHub(address, token=os.getenv(TOKEN_ENV)).start()
+        for index in range(count):
+            self.shard_processes.append(await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__),
+                "--config", self.config_file, "--meta_config", self.meta_config_file, "--shard", str(index), "--shards", str(count), "--bus", address,
+                stdin=asyncio.subprocess.DEVNULL,
+            ))
+        names = [f"shard-{index}" for index in range(count)]
+        self.join_cluster(names, "controller", None, address)
+        self.forward_control = True
+        self.agent_manager.use_id_stride(count, count + 1)
+        self.task_queue.use_id_stride(count, count + 1)
+        await self.cluster.connect()
+        await self.cluster.wait_for_peers(names, cluster_config.get("startup_timeout", 30.0))
+        print(f"Started {count} shards ({cluster_config.get('placement', 'role')} placement) on {address}.")
+
+    async def join_nodes(self):
+        """
+        Node mode: this controller hosts its share of the organisation (by the same placement
+        as shards) and joins the other nodes through the message broker. Every node keeps its
+        own CLI, and each sees the whole organisation.
+        """
+        cluster_config = self.config.get("cluster", {})
+        index = cluster_config.get("node_index", 0)
+        count = cluster_config.get("nodes", 2)
+        if not 0 <= index < count:
+            raise ValueError(f"Node index {index} is out of range for {count} nodes.")
+        address = cluster_config.get("broker_address", "tcp:127.0.0.1:7650")
+        name = f"node-{index}"
+        self.join_cluster([f"node-{k}" for k in range(count)], name, index, address)
+        self.forward_control = True
+        self.agent_manager.use_id_stride(index, count)
+        self.task_queue.use_id_stride(index, count)
+        await self.cluster.connect()
+        print(f"Joined the message broker at {address} as {name}; waiting for the other nodes...")
+        await self.cluster.wait_for_peers(
+            [peer for peer in self.cluster.peer_names if peer != name], cluster_config.get("startup_timeout", 30.0)
+        )
+        print(f"All {count} nodes connected.")
+
+    def join_cluster(self, peer_names, name, index, address):
+        config = {**self.config.get("cluster", {}), "address": address}
+        self.cluster = ClusterLink(
+            config, name, index, peer_names, self.agent_manager, self.task_queue, self.command_processor, list(self.roles_library)
+        )
+        self.cluster.control_handler = self.handle_control
+
+    def handle_control(self, action):
+        """Pause, resume, stop, flush or shut down this process at another peer's request."""
+        forward, self.forward_control = self.forward_control, False  # The sender has told everyone
         try:
-            await self.initialize_agents()  # Spawn initial agents
-            self.assign_initial_tasks()
-            print("Simulation environment initialized.")
-            self.running = True
-        except Exception as e:
-            print(f"Error during initialization: {e}")
+            self.apply_control(action)
         finally:
-            self.initializing = False
+            self.forward_control = forward
+
+    def apply_control(self, action):
+        if action == "pause" and self.running:
+            self.pause_simulation()
+        elif action == "resume" and not self.running:
+            self.resume_simulation()
+        elif action == "stop" and self.running:
+            self.stop_simulation()
+        elif action == "flush":
+            self.task_queue.flush_tasks()
+        elif action == "shutdown" and self.shutdown_event is not None:
+            self.shutdown_event.set()
+
+    async def run_shard(self, index, count, address):
+        """Entry point of a shard process: host this shard's agents until the controller shuts us down."""
+        name = f"shard-{index}"
+        self.use_shard_paths(name)
+        self.create_components()
+        self.shutdown_event = asyncio.Event()
+        # Ctrl-C reaches the shards too; shut down in order rather than be torn down mid-frame
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(signum, self.shutdown_event.set)
+        self.join_cluster([f"shard-{k}" for k in range(count)], name, index, address)
+        self.agent_manager.use_id_stride(index, count + 1)
+        self.task_queue.use_id_stride(index, count + 1)
+        await self.cluster.connect()
+        self.running = True
+        lost = asyncio.create_task(self.cluster.bus.closed.wait())
+        await asyncio.wait([lost, asyncio.create_task(self.shutdown_event.wait())], return_when=asyncio.FIRST_COMPLETED)
+        for agent_id in self.agent_manager.get_active_agents():
+            self.agent_manager.agents[agent_id].stop()
+        self.task_queue.close()
+        await self.agent_manager.close()
+
+    def use_shard_paths(self, name):
+        """Give each shard its own task store, spill directory, hibernation store and transcript."""
+        def suffixed(path):
+            root, extension = os.path.splitext(path)
+            return f"{root}_{name}{extension}"
+        task_queue = self.config.setdefault("task_queue", {})
+        agent_manager = self.config.setdefault("agent_manager", {})
+        for section, key, default in (
+            (task_queue, "sqlite_path", "data/task_queue.db"),
+            (task_queue, "completed_spill_dir", "data/completed"),
+            (agent_manager.setdefault("hibernation", {}), "path", "data/hibernation.db"),
+            (agent_manager.setdefault("llm_recording", {}), "path", "data/llm_transcript.jsonl"),
+        ):
+            path = section.get(key, default)
+            if path:  # A null spill directory turns spilling off
+                section[key] = suffixed(path)
+
+    async def stop_shards(self):
+        """Ask the shards to shut down and wait for them to exit."""
+        self.cluster.control("shutdown")
+        for process in self.shard_processes:
+            try:
+                await asyncio.wait_for(process.wait(), 10)
+            except asyncio.TimeoutError:
+                process.kill()
+        self.shard_processes = []
+        await self.message_hub.close()
 
     async def initialize_agents(self):
         """Initialize agents based on the initial_agents list in the meta-config."""
@@ -175,9 +334,9 @@ class SimulationController:
             assigned_role = task.get("assigned_role")
             if assigned_role in self.roles_library:
                 task_to_add = {
-                    "id": len(self.task_queue.get_all_tasks()) + 1,
+                    "id": self.task_queue.new_task_id(),
                     "description": task["description"],
-                    "priority": "medium",
+                    "priority": task.get("priority", "medium"),
                     "role": assigned_role
                 }
                 self.task_queue.add_task(task_to_add)
@@ -211,6 +370,8 @@ class SimulationController:
         # Notify all agents to stop their activity loops
         for agent_id in self.agent_manager.get_active_agents():
             self.agent_manager.agents[agent_id].stop()
+        if self.forward_control:
+            self.cluster.control("pause")
 
         print("Simulation paused.")
 
@@ -229,6 +390,8 @@ class SimulationController:
             if not agent.active: # only restart if the agent was stopped
                 agent.active = True
                 asyncio.create_task(agent.activity_loop())
+        if self.forward_control:
+            self.cluster.control("resume")
 
         print("Simulation resumed.")
 
@@ -245,6 +408,8 @@ class SimulationController:
         active_agents = self.agent_manager.get_active_agents()
         for agent_id in active_agents:
             self.agent_manager.terminate_agent(agent_id)
+        if self.forward_control:
+            self.cluster.control("stop")
 
         # Clear tasks
         self.task_queue.clear_tasks()
@@ -262,24 +427,8 @@ class SimulationController:
             print(f"Agent with ID '{agent_id}' not found. Available agents: {list(self.agent_manager.agents.keys())}")
             return
 
-        # Fetch the current list of agents dynamically
-        staff_list = ", ".join(
-            f"{aid} ({a.params.get('role', 'Unknown Role')})"
-            for aid, a in self.agent_manager.agents.items()
-        )
-
-        # Construct the system prompt dynamically
-        system_prompt = (
-            f"You are agent {agent.params.get('name')}, "
-            f"the {agent.params.get('description', 'role description not provided')}.\n"
-            f"{agent.params.get('prompt', 'act within your capacity')}.\n\n"
-            f"Commands you can execute are:\n"
-            f"{''.join(f'{cmd}: {info['description']} (Syntax: {info['syntax']})\n' for cmd, info in agent.COMMAND_DEFINITIONS.items())}\n"
-            "Commands must start on a blank line. If you have no command, nothing will be done.\n\n"
-            f"Your direct supervisor is: {agent.params.get('boss', 'None')}.\n"
-            f"Your direct reports are: {', '.join(agent.subordinates) or 'None'}.\n\n"
-            f"The current list of agents in this organization is: {staff_list}."
-        )
+        # The same system prompt the agent sends with its next task
+        system_prompt = self.agent_manager.prompt_builder.system_prompt(agent)
 
         print("\n\033[36m========== AGENT DEBUG INFORMATION ==========\033[0m")
         print(f"Agent ID: {agent_id}")
@@ -296,8 +445,8 @@ class SimulationController:
 
         # Print the conversation history
         print("\n\033[34mConversation History:\033[0m")
-        if agent.conversation:
-            for idx, msg in enumerate(agent.conversation):
+        if agent.conversation or agent.conversation_summary:
+            for idx, msg in enumerate(agent.get_conversation_history()):
                 role = msg.get("role", "Unknown").capitalize()
                 content = msg.get("content", "No content")
                 print(f"  [{idx}] {role}: {content}")
@@ -306,25 +455,28 @@ class SimulationController:
 
         # Safely print pending messages from asyncio.Queue
         print("\n\033[35mPending Messages:\033[0m")
-        if agent.message_queue.empty():
+        if agent._inbox is None or agent._inbox.empty():
             print("  No pending messages.")
         else:
             print("  Messages in queue:")
-            pending_messages = []
-            while not agent.message_queue.empty():
-                message = agent.message_queue.get_nowait()
-                pending_messages.append(message)
-
-            # Print the messages and re-queue them to preserve integrity
-            for idx, message in enumerate(pending_messages):
-                print(f"  [{idx}] From: {message['from']}, Message: {message['message']}")
-                agent.message_queue.put_nowait(message)
+            # Read the inbox in priority order without draining it
+            for idx, message in enumerate(agent.message_queue.pending()):
+                print(f"  [{idx}] ({message.get('priority', 'medium')}) {message.get('description', '')}")
 
         # Print task queue reference safely
         print("\n\033[32mTasks Pending or Completed:\033[0m")
         print(f"  Task Queue Reference: {repr(agent.task_queue)}")
         print("\033[36m=============================================\033[0m")
 
+    async def shutdown(self):
+        """Stop any shards, commit batched task queue writes and release the agents' shared resources."""
+        if self.shard_processes:
+            await self.stop_shards()
+        if self.task_queue:
+            self.task_queue.close()  # Commit any batched task queue writes
+        if self.agent_manager:
+            await self.agent_manager.close()
+
     async def run_interactive_mode(self):
         """Run the simulation in interactive mode using asynchronous input."""
         print("Entering interactive mode. Type 'help' for commands.")
@@ -333,6 +485,7 @@ class SimulationController:
                 command = await aioconsole.ainput(">> ")  # Asynchronous input
                 if command == "exit":
                     print("Exiting simulation.")
+                    await self.shutdown()
                     break                               
                 elif command == "help":
                     self.print_help()
@@ -349,22 +502,37 @@ class SimulationController:
                     task_desc = " ".join(task_parts)
                     required_agent = (await aioconsole.ainput("Assign to specific agent (leave blank if none): ")).strip() or None
                     role = (await aioconsole.ainput("Assign to role (leave blank if none): ")).strip() or None
+                    priority = (await aioconsole.ainput("Priority (urgent/high/medium/low, leave blank for medium): ")).strip() or "medium"
 
                     # Delegate to TaskQueue
                     task = {
-                        "id": len(self.task_queue.get_all_tasks()) + 1,
+                        "id": self.task_queue.new_task_id(),
                         "description": task_desc,
-                        "priority": "medium",
+                        "priority": priority,
                         "required_agent": required_agent,
                         "role": role,
                     }
                     # Add the task
                     self.task_queue.add_task(task)
                 elif command == "list_tasks":
-                    print(self.task_queue.get_all_tasks())
-                    print(self.task_queue.get_completed_tasks())
+                    pending = self.task_queue.get_all_tasks()
+                    completed = list(self.task_queue.get_completed_tasks())
+                    if self.cluster:
+                        # Tasks handed between shards are recorded by both; show each once
+                        seen = {task.get("id") for task in completed}
+                        for shard_tasks in (await self.cluster.ask_peers("list_tasks")).values():
+                            pending.extend(shard_tasks["pending"])
+                            for task in shard_tasks["completed"]:
+                                if task.get("id") not in seen:
+                                    seen.add(task.get("id"))
+                                    completed.append(task)
+                    print(pending)
+                    print(completed)
                 elif command == "metrics":
-                    print(self.performance_monitor.get_system_metrics())
+                    metrics = self.performance_monitor.get_system_metrics()
+                    if self.cluster:
+                        metrics = {self.cluster.name: metrics, **await self.cluster.ask_peers("metrics")}
+                    print(metrics)
                 elif command.startswith("message_agent"):
                     if not self.agent_manager:
                         print("Simulation not started. Use 'start' command first.")
@@ -372,10 +540,11 @@ class SimulationController:
                     try:
                         _, agent_id, *message_parts = command.split(maxsplit=2)
                         message = " ".join(message_parts)
-                        if agent_id not in self.agent_manager.get_active_agents():
+                        agent = self.agent_manager.get_agent(agent_id)  # Local, or in another shard
+                        if agent is None:
                             print(f"Agent {agent_id} not found.")
                         else:
-                            await self.agent_manager.agents[agent_id].receive_message(
+                            await agent.receive_message(
                                 {"from": "User", "message": message}
                             )
                             print(f"Message sent to {agent_id}: {message}")
@@ -395,11 +564,12 @@ class SimulationController:
                         sent_to = 0
 
                         # Send message to all agents matching the target role
-                        for agent_id, agent in self.agent_manager.agents.items():
-                            if agent.params.get("role") == target_role:
-                                await agent.receive_message({"from": "User", "message": message})
-                                print(f"Message sent to {agent_id} ({target_role})")
-                                sent_to += 1
+                        for agent in self.agent_manager.agents_with_role(target_role):
+                            await agent.receive_message({"from": "User", "message": message})
+                            print(f"Message sent to {agent.agent_id} ({target_role})")
+                            sent_to += 1
+                        if self.cluster:
+                            sent_to += self.cluster.message_role(target_role, f"Message from User: {message}", "medium")
 
                         if sent_to == 0:
                             print(f"No agents found with role '{target_role}'.")
@@ -422,15 +592,21 @@ class SimulationController:
                         print("Simulation not started. Use 'start' command first.")
                         continue
                     self.task_queue.flush_tasks()
+                    if self.forward_control:
+                        self.cluster.control("flush")
                     print("Task queue flushed successfully.")
                 elif command.startswith("agent_info"):
                     try:
                         _, agent_id = command.split(maxsplit=1)
-                        if agent_id not in self.agent_manager.get_active_agents():
+                        if agent_id in self.agent_manager.agents:
+                            info = self.agent_manager.agents[agent_id].get_info()
+                        elif self.cluster and agent_id in self.cluster.remote_agents:
+                            info = await self.cluster.ask_owner(agent_id, "agent_info")
+                        else:
+                            info = None
+                        if not info:
                             print(f"Agent {agent_id} not found.")
                         else:
-                            agent = self.agent_manager.agents[agent_id]
-                            info = agent.get_info()
                             print("\n\033[33m--- Agent Information ---\033[0m")
                             for key, value in info.items():
                                 print(f"\033[36m{key}:\033[0m {value}")
@@ -466,8 +642,19 @@ class SimulationController:
                 elif command.startswith ("internet_fetch"):
                     result = await self.command_processor.process_command(command)
                     print(result)  
+                elif command.startswith ("add_subtask"):
+                    result = await self.command_processor.process_command(command)
+                    print(result)
+                elif command.startswith(("task_info", "cancel_task", "set_priority")):
+                    result = await self.command_processor.process_command(command)
+                    print(result)
                 else:
                     print("Unknown command. Type 'help' for a list of commands.")
+            except asyncio.CancelledError:
+                # Ctrl-C: stop the shards and close the bus cleanly before asyncio.run() reports the interrupt
+                print("Interrupted; shutting down.")
+                await self.shutdown()
+                raise
             except Exception as e:
                 print(f"Error in interactive mode: {e}")
 
@@ -483,6 +670,10 @@ Available Commands:
     list_agents              - List all active agents
     add_task <desc>          - Add a new task with optional metadata
     list_tasks               - List all tasks in the queue
+    add_subtask <parent> <role|agent> <desc> - Add a sub task the parent task waits for
+    task_info <task_id>      - Show where a task or message is waiting
+    cancel_task <task_id>    - Cancel a queued task or message
+    set_priority <task_id> <priority> - Change the priority of a queued task or message
     metrics                  - Show system performance metrics
     message_agent <agent> <msg>- Send a message to an agent
     message_role <role> <msg>- Send a message to an agent
@@ -498,6 +689,18 @@ Available Commands:
 """)
 
 if __name__ == "__main__":
-    controller = SimulationController(meta_config_file=args.meta_config)
-    asyncio.run(controller.run_interactive_mode())
+    controller = SimulationController(config_file=args.config, meta_config_file=args.meta_config)
+    if args.node is not None or args.nodes is not None or args.broker is not None:
+        cluster_config = controller.config.setdefault("cluster", {})
+        cluster_config["mode"] = "node"
+        for key, value in (("node_index", args.node), ("nodes", args.nodes), ("broker_address", args.broker)):
+            if value is not None:
+                cluster_config[key] = value
+    if args.shard is not None:
+        asyncio.run(controller.run_shard(args.shard, args.shards, args.bus))
+    else:
+        try:
+            asyncio.run(controller.run_interactive_mode())
+        except KeyboardInterrupt:
+            pass  # Already shut down by run_interactive_mode
 
@@ -0,0 +1,83 @@
+import asyncio
+import time
+import unittest
+
+from components.llm_backends import ChatResult, LLMBackend
+from components.llm_gateway import LLMGateway, LLMGatewayError
+
+
+class HangingBackend(LLMBackend):
+    """Backend whose first call hangs until cancelled; later calls answer at once."""
+    endpoint = "hanging"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def chat(self, model, messages):
+        self.calls += 1
+        if self.calls == 1:
+            await asyncio.Event().wait()
+        return ChatResult("ok", model)
+
+
+class SlowStreamBackend(LLMBackend):
+    """Streams two pieces of text, `delay` seconds apart."""
+    endpoint = "slow-stream"
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def stream_chat(self, model, messages, on_text):
+        for piece in ("first\n", "second\n"):
+            await asyncio.sleep(self.delay)
+            await on_text(piece)
+        return ChatResult("first\nsecond\n", model)
+
+
+class CircuitBreakerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_cancelled_probe_lets_another_call_probe(self):
+        gateway = LLMGateway({"breaker_cooldown": 0.1})
+        backend = HangingBackend()
+        breaker = gateway._breaker_for(backend)
+        breaker.state = "open"
+        breaker.opened_at = time.monotonic() - 1.0  # Cooldown already over
+
+        probe = asyncio.create_task(gateway.chat(backend, "test-model", [{"role": "user", "content": "hi"}]))
+        await asyncio.sleep(0.05)
+        self.assertTrue(breaker.probe_in_flight)
+        probe.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await probe
+
+        self.assertFalse(breaker.probe_in_flight)
+        result = await asyncio.wait_for(gateway.chat(backend, "test-model", [{"role": "user", "content": "hi"}]), 2.0)
+        self.assertEqual(result.content, "ok")
+        self.assertEqual(breaker.state, "closed")
+
+
+class StreamDeadlineTest(unittest.IsolatedAsyncioTestCase):
+    async def test_slow_callback_does_not_count_against_the_deadline(self):
+        gateway = LLMGateway({"timeouts": {"default": 0.2}, "max_retries": 0})
+        received = []
+
+        async def on_text(text):
+            received.append(text)
+            await asyncio.sleep(0.3)  # A slow command, longer than the whole deadline
+
+        result = await gateway.chat(SlowStreamBackend(0.05), "test-model", [{"role": "user", "content": "hi"}], on_text)
+        self.assertEqual(result.content, "first\nsecond\n")
+        self.assertEqual(received, ["first\n", "second\n"])
+
+    async def test_slow_provider_still_times_out(self):
+        gateway = LLMGateway({"timeouts": {"default": 0.1}, "max_retries": 0})
+
+        async def on_text(text):
+            pass
+
+        with self.assertRaises(LLMGatewayError) as raised:
+            await gateway.chat(SlowStreamBackend(0.3), "test-model", [{"role": "user", "content": "hi"}], on_text)
+        self.assertEqual(raised.exception.kind, "timeout")
+
+
+if __name__ == "__main__":
+    unittest.main()